@@ -0,0 +1,90 @@
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ner.constants import FIRST_NAMES, SECOND_NAMES
+
+
+# global parameters
+HOST = "127.0.0.1"
+PORT = 11435            # next to the default Ollama port, so a real server can run alongside
+LATENCY = 0.05          # seconds per request
+NAMES = {name.lower() for name in FIRST_NAMES + SECOND_NAMES}
+WORD_PATTERN = re.compile(r"[^\W\d_]+")
+PACKED_LINE_PATTERN = re.compile(r"^\s*\[(\d+)\]\s*(.*)$")
+
+
+def find_names(text):
+    """The words of the text that are known names, capitalized, in order of appearance."""
+    return [word.capitalize() for word in WORD_PATTERN.findall(text) if word.lower() in NAMES]
+
+##----------------------------------------##
+
+def answer(prompt):
+    """A deterministic answer in the format the prompts of main.py ask for."""
+    input_text = prompt.split("**INPUT**", 1)[-1]
+    packed_lines = [PACKED_LINE_PATTERN.match(line) for line in input_text.splitlines()]
+    packed_lines = [match for match in packed_lines if match is not None]
+    if packed_lines:
+        return "\n".join(f"{match.group(1)}: {name}" for match in packed_lines for name in find_names(match.group(2)))
+
+    return "\n".join(find_names(input_text.split("TEXT:", 1)[-1]))
+
+##----------------------------------------##
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """Serves /api/generate like Ollama does with stream=False, after a fixed latency."""
+    latency = LATENCY
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self.send_error(404)
+            return
+
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        time.sleep(self.latency)
+
+        response = json.dumps({
+            "model": request.get("model", ""),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "response": answer(request.get("prompt", "")),
+            "done": True,
+            "done_reason": "stop",
+            "context": [],
+            "total_duration": int(self.latency * 1e9),
+        }).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+##----------------------------------------##
+
+def start_server(host=HOST, port=PORT, latency=LATENCY):
+    """Starts the fake server in a background thread. Returns the server and its address for --ollama_host."""
+    handler = type("Handler", (FakeOllamaHandler,), {"latency": latency})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', default=PORT, type=int, help='port to listen on')
+    parser.add_argument('--latency', default=LATENCY, type=float, help='latency of a request, in seconds')
+    args = parser.parse_args()
+
+    server, address = start_server(HOST, args.port, args.latency)
+    print(f"Fake Ollama server is listening on {address}, press Ctrl+C to stop.")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,74 @@
+import argparse
+import fitz  # PyMuPDF
+import os
+import random
+from ner.constants import FIRST_NAMES, SECOND_NAMES
+
+
+# global parameters
+NUM_DOCUMENTS = 2
+NUM_PAGES = 40
+SENTENCES_PER_PAGE = 30
+NAME_RATIO = 0.3        # part of the sentences that mention a name
+SEED = 17
+PAGE_MARGIN = 50
+FONT_SIZE = 10
+
+SUBJECTS = ["The old house", "A small boat", "The letter", "The morning train", "Their garden", "The river"]
+VERBS = ["was waiting near", "stood beside", "was found under", "disappeared behind", "looked across"]
+OBJECTS = ["the village square", "the quiet harbour", "an empty road", "the market hall", "the northern hills"]
+NAME_TEMPLATES = [
+    "{name} {surname} walked into the room and sat down.",
+    "Everybody said that {name} had left the town years ago.",
+    "Later that evening, Mr. {surname} wrote to {name} about the trip.",
+    "It was {name} who noticed the light in the window first.",
+    "\"Come in,\" said {name} {surname}, opening the door.",
+]
+
+
+def make_sentence(rand):
+    if rand.random() < NAME_RATIO:
+        return rand.choice(NAME_TEMPLATES).format(name=rand.choice(FIRST_NAMES), surname=rand.choice(SECOND_NAMES))
+    return f"{rand.choice(SUBJECTS)} {rand.choice(VERBS)} {rand.choice(OBJECTS)}."
+
+##----------------------------------------##
+
+def make_pdf(full_file_path, num_pages, seed):
+    """Writes a PDF of num_pages pages of random sentences, some of them mentioning names from ner/constants.py."""
+    rand = random.Random(seed)
+    doc = fitz.open()
+    for page_index in range(num_pages):
+        page = doc.new_page()
+        rect = fitz.Rect(PAGE_MARGIN, PAGE_MARGIN, page.rect.width - PAGE_MARGIN, page.rect.height - PAGE_MARGIN)
+        # a few sentences per paragraph, so the paragraph reading method sees blocks too
+        sentences = [make_sentence(rand) for _ in range(SENTENCES_PER_PAGE)]
+        paragraphs = [" ".join(sentences[i:i + 5]) for i in range(0, len(sentences), 5)]
+        page.insert_textbox(rect, f"Page {page_index + 1}\n\n" + "\n\n".join(paragraphs), fontsize=FONT_SIZE)
+
+    doc.save(full_file_path)
+    doc.close()
+
+##----------------------------------------##
+
+def make_pdfs(output_folder, num_documents=NUM_DOCUMENTS, num_pages=NUM_PAGES, seed=SEED):
+    """Writes num_documents synthetic PDFs into the folder and returns their paths. Same seed, same documents."""
+    os.makedirs(output_folder, exist_ok=True)
+    paths = []
+    for document_index in range(num_documents):
+        full_file_path = os.path.join(output_folder, f"synthetic-{document_index}.pdf")
+        make_pdf(full_file_path, num_pages, seed + document_index)
+        paths.append(full_file_path)
+
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output_folder', default="input", help='folder of the generated PDFs')
+    parser.add_argument('-d', '--documents', default=NUM_DOCUMENTS, type=int, help='number of documents')
+    parser.add_argument('-p', '--pages', default=NUM_PAGES, type=int, help='number of pages per document')
+    parser.add_argument('--seed', default=SEED, type=int, help='random seed')
+    args = parser.parse_args()
+
+    for path in make_pdfs(args.output_folder, args.documents, args.pages, args.seed):
+        print(f"Wrote {path}.")
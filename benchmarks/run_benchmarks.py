@@ -0,0 +1,146 @@
+"""Benchmarks of the whole pipeline of main.py on synthetic PDFs, against a fake Ollama server and a stub GLiNER model,
+so they run offline on a CPU only box. Run from the repository root:
+
+    python3 -m benchmarks.run_benchmarks                   # compare with benchmarks/baseline.json
+    python3 -m benchmarks.run_benchmarks --save_baseline   # store the current results as the baseline
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import main
+from benchmarks.fake_ollama import NAMES, start_server
+from benchmarks.make_pdfs import make_pdfs
+from metrics import metrics
+
+
+# global parameters
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "baseline.json")
+TOLERANCE = 0.2         # relative change that counts as a regression
+NER_CALL_LATENCY = 0.002    # seconds per call of the stub model
+NER_WORD_LATENCY = 0.0001   # seconds per word of the stub model
+WORD_PATTERN = re.compile(r"[^\W\d_]+")
+SCENARIOS = {
+    "ner_sentence": ["-pm", "ner", "-rm", "sentence", "-nt", "base", "-p", "2-", "-cl", "all"],
+    "ner_sentence_batched": ["-pm", "ner", "-rm", "sentence", "-nt", "base", "-p", "2-", "-cl", "all", "-bs", "16", "-bp", "4"],
+    "ner_page_windows": ["-pm", "ner", "-rm", "page", "-nt", "base", "-p", "2-", "-bs", "8"],
+    "ner_paragraph_workers": ["-pm", "ner", "-rm", "paragraph", "-nt", "base", "-p", "2-", "-cl", "all", "-bs", "16", "-w", "4"],
+    "llm_sentence_concurrent": ["-pm", "llm", "-rm", "sentence", "-nt", "none", "-p", "2-", "-cl", "all", "-c", "8"],
+    "llm_sentence_packed": ["-pm", "llm", "-rm", "sentence", "-nt", "none", "-p", "2-", "-cl", "all", "-c", "8", "-pt", "1000"],
+    "cascade_sentence": ["-pm", "cascade", "-rm", "sentence", "-nt", "base", "-p", "2-", "-cl", "all", "-bs", "16", "-c", "8"],
+}
+# higher is better for the throughput, lower is better for the latency and the memory
+HIGHER_IS_BETTER = ("pages_per_second", "chunks_per_second")
+LOWER_IS_BETTER = ("latency_p50", "latency_p95", "latency_p99", "peak_rss_mb")
+
+
+class StubGLiNER:
+    """Stands in for GLiNER: finds the known names of the text, taking a fixed time per call and per word."""
+
+    def predict_entities(self, text, labels, threshold=0.5):
+        return self.batch_predict_entities([text], labels, threshold)[0]
+
+    def batch_predict_entities(self, texts, labels, threshold=0.5):
+        time.sleep(NER_CALL_LATENCY + NER_WORD_LATENCY * sum(len(text.split()) for text in texts))
+        return [[{"start": match.start(), "end": match.end(), "text": match.group(0), "label": labels[0], "score": 0.9}
+                 for match in WORD_PATTERN.finditer(text) if match.group(0).lower() in NAMES]
+                for text in texts]
+
+##----------------------------------------##
+
+def run_scenario(argv, input_folder, ollama_host):
+    """Runs the pipeline once, without cache, output or manifest, and returns its measurements."""
+    args = main.parse_args(argv + ["--no_cache", "-q", "--ollama_host", ollama_host])
+    main.INPUT_FOLDER = input_folder
+    main.ner_models[(main.NerType.base, main.NER_CHECKPOINTS[main.NerType.base], "torch")] = StubGLiNER()
+
+    metrics.enable()
+    main.process_files(args)
+    summary = metrics.summary()
+
+    extract = summary["stages"].get("extract", {})
+    return {
+        "pages_per_second": summary["throughput"].get("pages_per_second", 0.0),
+        "chunks_per_second": summary["throughput"].get("chunks_per_second", 0.0),
+        "latency_p50": extract.get("p50", 0.0),
+        "latency_p95": extract.get("p95", 0.0),
+        "latency_p99": extract.get("p99", 0.0),
+        "peak_rss_mb": summary["peak_rss_mb"],
+        "chunks": summary["counters"].get("chunks", 0),
+    }
+
+##----------------------------------------##
+
+def run_scenario_process(argv, input_folder, ollama_host):
+    """Runs the scenario in a fresh process, as the peak RSS is the one of the whole process lifetime: in a shared
+    process every scenario would report the peak of the scenarios before it. The memory of the reader worker
+    processes of a scenario isn't included."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(run_scenario, argv, input_folder, ollama_host).result()
+
+##----------------------------------------##
+
+def compare(results, baseline):
+    """Returns the regressions of the results compared to the baseline."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        for key in HIGHER_IS_BETTER:
+            if result[key] < baseline[name][key] * (1 - TOLERANCE):
+                regressions.append(f"{name}: {key} dropped from {baseline[name][key]:.3f} to {result[key]:.3f}")
+        for key in LOWER_IS_BETTER:
+            if key in baseline[name] and result[key] > baseline[name][key] * (1 + TOLERANCE):
+                regressions.append(f"{name}: {key} grew from {baseline[name][key]:.4f} to {result[key]:.4f}")
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--scenarios', nargs='*', default=list(SCENARIOS), choices=list(SCENARIOS), help='scenarios to run')
+    parser.add_argument('-d', '--documents', default=2, type=int, help='number of synthetic documents')
+    parser.add_argument('-p', '--pages', default=40, type=int, help='number of pages per synthetic document')
+    parser.add_argument('--llm_latency', default=0.05, type=float, help='latency of the fake Ollama server, in seconds')
+    parser.add_argument('--save_baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='path of the baseline JSON')
+    args = parser.parse_args()
+
+    server, ollama_host = start_server(port=0, latency=args.llm_latency)
+    results = {}
+    with tempfile.TemporaryDirectory() as input_folder:
+        make_pdfs(input_folder, args.documents, args.pages)
+
+        print(f"{'scenario':<26}{'pages/s':>10}{'chunks/s':>10}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}{'RSS MB':>9}")
+        for name in args.scenarios:
+            results[name] = run_scenario_process(SCENARIOS[name], input_folder, ollama_host)
+            result = results[name]
+            print(f"{name:<26}{result['pages_per_second']:>10.2f}{result['chunks_per_second']:>10.2f}"
+                  f"{result['latency_p50']:>9.3f}{result['latency_p95']:>9.3f}{result['latency_p99']:>9.3f}"
+                  f"{result['peak_rss_mb']:>9.1f}")
+    server.shutdown()
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved the baseline to {args.baseline}.")
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print(f"There is no baseline at {args.baseline}, store one with --save_baseline.")
+        sys.exit(0)
+
+    with open(args.baseline, "r") as f:
+        regressions = compare(results, json.load(f))
+
+    for regression in regressions:
+        print(f"REGRESSION. {regression}")
+    print(f"{len(regressions)} regressions (tolerance {TOLERANCE:.0%}).")
+    sys.exit(1 if regressions else 0)
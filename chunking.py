@@ -0,0 +1,67 @@
+import re
+
+
+# global parameters
+WINDOW_SIZE = 300       # GLiNER words, its models truncate their input beyond a max_len of 384 of them
+WINDOW_STRIDE = 240     # GLiNER words, the windows overlap by WINDOW_SIZE - WINDOW_STRIDE words
+SENTENCE_END_PATTERN = re.compile(r'[.!?]+')
+# the word splitter of GLiNER, which makes every punctuation mark a word of its own
+GLINER_WORD_PATTERN = re.compile(r'\w+(?:[-_]\w+)*|\S')
+LAST_WORD_PATTERN = re.compile(r'\S+$')
+# words ending with a period that don't end a sentence
+ABBREVIATIONS = {
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "mt", "rev", "gen", "col", "capt", "lt", "sgt",
+    "vs", "e.g", "i.e", "vol", "fig", "inc", "ltd", "co",
+}
+
+
+def split_sentences(text):
+    """Splits the text into sentences and returns their (start, end) offsets. Unlike a plain split on [.!?],
+    abbreviations (e.g. "Mr.") and initials (e.g. "J.") don't end a sentence. Text after the last sentence end is dropped."""
+    spans = []
+    start = 0
+    for match in SENTENCE_END_PATTERN.finditer(text):
+        if match.group(0) == ".":
+            last_word = LAST_WORD_PATTERN.search(text, start, match.start())
+            word = last_word.group(0).lstrip("\"'“‘(").lower() if last_word else ""
+            if word in ABBREVIATIONS or (len(word) == 1 and word.isalpha()):
+                continue
+
+        spans.append((start, match.end()))
+        start = match.end()
+
+    return spans
+
+##----------------------------------------##
+
+def make_windows(text, window_size=WINDOW_SIZE, window_stride=WINDOW_STRIDE):
+    """Splits a long text into overlapping windows of window_size words, every window_stride words. The words are
+    counted like GLiNER counts them against its max_len, so '"Yes," he said.' is 7 words and not 3.
+    Returns (offset, window text) pairs, the windows are exact substrings of the text. Short texts are a single window."""
+    words = [match.span() for match in GLINER_WORD_PATTERN.finditer(text)]
+    if window_size <= 0 or len(words) <= window_size:
+        return [(0, text)]
+
+    window_stride = max(1, min(window_stride, window_size))
+    windows = []
+    for first in range(0, len(words), window_stride):
+        last = min(first + window_size, len(words)) - 1
+        start = words[first][0]
+        windows.append((start, text[start:words[last][1]]))
+        if last == len(words) - 1:
+            break
+
+    return windows
+
+##----------------------------------------##
+
+def merge_entities(text, entities):
+    """Merges the entities found in overlapping windows, which are already shifted to offsets in the text.
+    Of overlapping spans with the same label, only the highest scoring one is kept."""
+    merged = []
+    for ent in sorted(entities, key=lambda ent: ent["score"], reverse=True):
+        if any(ent["label"] == kept["label"] and ent["start"] < kept["end"] and kept["start"] < ent["end"] for kept in merged):
+            continue
+        merged.append(dict(ent, text=text[ent["start"]:ent["end"]]))
+
+    return sorted(merged, key=lambda ent: ent["start"])
@@ -0,0 +1,201 @@
+import hashlib
+import random
+import re
+import zlib
+from collections import OrderedDict
+from result_cache import normalize_text
+
+
+# global parameters
+MAX_ENTRIES = 100000    # results kept for the fan-out, the least recently used ones are dropped beyond it
+NUM_PERMUTATIONS = 64   # MinHash signature size
+LSH_BANDS = 16          # signature bands, two texts are compared when any band matches
+SHINGLE_SIZE = 3        # words per shingle
+MINHASH_SEED = 17
+MERSENNE_PRIME = (1 << 61) - 1
+HEADER_SAMPLE_PAGES = 50    # pages sampled for the header and footer analysis
+HEADER_MARGIN = 0.12        # top and bottom part of the page height where headers and footers are looked for
+HEADER_MIN_RATIO = 0.5      # part of the sampled pages a block has to repeat on
+HEADER_MIN_PAGES = 3
+DIGITS_PATTERN = re.compile(r"\d+")
+WORD_PATTERN = re.compile(r"\w+")
+
+_rand = random.Random(MINHASH_SEED)
+PERMUTATIONS = [(_rand.randrange(1, MERSENNE_PRIME), _rand.randrange(0, MERSENNE_PRIME)) for _ in range(NUM_PERMUTATIONS)]
+
+
+def minhash(text):
+    """The MinHash signature of the word shingles of the text, ignoring the case and the punctuation."""
+    words = WORD_PATTERN.findall(text.lower())
+    shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+    hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in shingles]
+    return tuple(min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in PERMUTATIONS)
+
+##----------------------------------------##
+
+def similarity(signature, other_signature):
+    """Estimates the Jaccard similarity of two texts from their MinHash signatures."""
+    return sum(1 for a, b in zip(signature, other_signature) if a == b) / len(signature)
+
+##----------------------------------------##
+
+def find_word(text, name, start=0):
+    """The offset of the first occurrence of the name in the text from start on, as whole words (not inside
+    another word, so "ann" is not found in "joanna"), or -1."""
+    match = re.compile(r"(?<!\w)" + re.escape(name) + r"(?!\w)").search(text, start)
+    return match.start() if match else -1
+
+##----------------------------------------##
+
+def remap_result(result, text):
+    """Moves the result of a (near) duplicate chunk onto the text of another occurrence: the entities get the offsets
+    of their first whole word occurrence in the text (after the previous entity), the LLM names are kept if they occur
+    in it as whole words. What doesn't occur in the text is dropped."""
+    lower_text = text.lower()
+    if result is None:
+        return None
+    if isinstance(result, str):
+        return "\n".join(name for name in result.splitlines() if name.strip() and find_word(lower_text, name.strip().lower()) >= 0)
+
+    entities = []
+    cursor = 0
+    for ent in result:
+        name = ent["text"].lower()
+        if not name:
+            continue
+        start = find_word(lower_text, name, cursor)
+        if start < 0:
+            start = find_word(lower_text, name)
+        if start < 0:
+            continue
+
+        entities.append({**ent, "text": text[start:start + len(name)], "start": start, "end": start + len(name)})
+        cursor = start + len(name)
+
+    return entities
+
+##----------------------------------------##
+
+class ChunkDeduplicator:
+    """In-run dedup of the chunks sent to the model. A chunk whose (whitespace normalized) text was already seen,
+    or, with a near_threshold, whose estimated word shingle similarity to a seen chunk reaches it, is not parsed
+    again: the result of the first occurrence is fanned out to it. Keeps the results of up to MAX_ENTRIES chunks."""
+
+    def __init__(self, near_threshold=0.0, max_entries=MAX_ENTRIES):
+        self.near_threshold = near_threshold
+        self.max_entries = max_entries
+        self.entries = OrderedDict()    # key -> {"text", "result", "signature", "bands"}
+        self.buckets = {}               # (band index, band) -> keys
+        self.chunks = 0
+        self.exact = 0
+        self.near = 0
+
+    def find_near(self, signature):
+        rows = NUM_PERMUTATIONS // LSH_BANDS
+        bands = [(band, signature[band * rows:(band + 1) * rows]) for band in range(LSH_BANDS)]
+        best_key, best_similarity = None, self.near_threshold
+        for band in bands:
+            for key in self.buckets.get(band, ()):
+                entry_similarity = similarity(signature, self.entries[key]["signature"])
+                if entry_similarity >= best_similarity:
+                    best_key, best_similarity = key, entry_similarity
+
+        return best_key, bands
+
+    def assign(self, texts):
+        """Returns the key of every text and the indices of the texts that have to be parsed (one per new key).
+        The new keys are pending until complete is called with their results."""
+        keys = []
+        new_indices = []
+        for index, text in enumerate(texts):
+            self.chunks += 1
+            key = hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=16).digest()
+            if key in self.entries:
+                self.exact += 1
+                self.entries.move_to_end(key)
+                keys.append(key)
+                continue
+
+            signature = bands = None
+            if self.near_threshold > 0:
+                signature = minhash(text)
+                near_key, bands = self.find_near(signature)
+                if near_key is not None:
+                    self.near += 1
+                    self.entries.move_to_end(near_key)
+                    keys.append(near_key)
+                    continue
+
+            self.entries[key] = {"text": text, "result": None, "signature": signature, "bands": bands or []}
+            for band in bands or []:
+                self.buckets.setdefault(band, []).append(key)
+            keys.append(key)
+            new_indices.append(index)
+
+        return keys, new_indices
+
+    def complete(self, keys, results):
+        """Stores the results of the parsed (new) keys, and drops the least recently used entries beyond the limit."""
+        for key, result in zip(keys, results):
+            self.entries[key]["result"] = result
+
+        while len(self.entries) > self.max_entries:
+            key, entry = self.entries.popitem(last=False)
+            for band in entry["bands"]:
+                self.buckets[band].remove(key)
+                if not self.buckets[band]:
+                    del self.buckets[band]
+
+    def discard(self, keys):
+        """Forgets pending keys whose parsing failed."""
+        for key in keys:
+            entry = self.entries.pop(key, None)
+            for band in entry["bands"] if entry is not None else []:
+                self.buckets[band].remove(key)
+                if not self.buckets[band]:
+                    del self.buckets[band]
+
+    def result(self, key, text):
+        """The result of the key for the given occurrence of the chunk."""
+        entry = self.entries[key]
+        return entry["result"] if entry["text"] == text else remap_result(entry["result"], text)
+
+    def print_stats(self):
+        saved = self.exact + self.near
+        print(f"Dedup: {self.chunks} chunks, {self.exact} exact and {self.near} near duplicates, "
+              f"saving {saved} model calls ({(100.0 * saved / self.chunks if self.chunks else 0.0):.1f}%).")
+
+##----------------------------------------##
+
+def block_signature(text):
+    """Normalizes a block of text for the header and footer analysis, so "Page 12" and "Page 13" are the same."""
+    return DIGITS_PATTERN.sub("#", normalize_text(text).lower())
+
+##----------------------------------------##
+
+def is_margin_block(block, page_height):
+    return block[3] <= page_height * HEADER_MARGIN or block[1] >= page_height * (1 - HEADER_MARGIN)
+
+##----------------------------------------##
+
+def find_boilerplate(doc):
+    """Finds the repeated page headers and footers of the document: the signatures of the text blocks in the top or
+    bottom margin that repeat on at least HEADER_MIN_RATIO of up to HEADER_SAMPLE_PAGES evenly spread pages."""
+    step = max(1, doc.page_count // HEADER_SAMPLE_PAGES)
+    page_indices = range(0, doc.page_count, step)
+    counts = {}
+    for page_index in page_indices:
+        page = doc[page_index]
+        signatures = {block_signature(block[4]) for block in page.get_text("blocks")
+                      if block[6] == 0 and block[4].strip() and is_margin_block(block, page.rect.height)}
+        for signature in signatures:
+            counts[signature] = counts.get(signature, 0) + 1
+
+    min_pages = max(HEADER_MIN_PAGES, HEADER_MIN_RATIO * len(page_indices))
+    return frozenset(signature for signature, count in counts.items() if count >= min_pages)
+
+##----------------------------------------##
+
+def is_boilerplate(block, boilerplate, page_height):
+    """Whether the block is one of the repeated headers and footers (as found by find_boilerplate)."""
+    return bool(boilerplate) and is_margin_block(block, page_height) and block_signature(block[4]) in boilerplate
@@ -0,0 +1,192 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+
+
+# global parameters
+MAX_ENTRIES = 100000    # entries kept in memory, the rarest ones are pruned beyond it
+MAX_SAMPLES = 5         # sample offsets kept per entry
+MAX_FORMS = 8           # surface forms counted per entry, for the canonical form
+NAME_PATTERN = re.compile(r"[^\w\s'-]+")
+POSSESSIVE_PATTERN = re.compile(r"['’]s$")
+SPACES_PATTERN = re.compile(r"\s+")
+
+
+def normalize_name(name):
+    """Lowercases the name, drops the punctuation and a possessive 's, and collapses the whitespace."""
+    name = POSSESSIVE_PATTERN.sub("", SPACES_PATTERN.sub(" ", NAME_PATTERN.sub(" ", name.lower())).strip())
+    return name.strip(" '-")
+
+##----------------------------------------##
+
+class EntityIndex:
+    """Folds the entity mentions into a per document index: normalized name -> canonical (most frequent) form,
+    mention count, first and last page and a few sample offsets. The memory is bounded by MAX_ENTRIES entries
+    (the rarest ones are pruned first, and counted in pruned_mentions) and MAX_SAMPLES / MAX_FORMS per entry.
+    Indices built by parallel workers are combined with merge. The generation of a saved index is the one of the
+    run manifest flush that saved it, so a resumed run can check that the two match."""
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_samples=MAX_SAMPLES):
+        self.max_entries = max_entries
+        self.max_samples = max_samples
+        self.entries = {}       # (document, name) -> entry
+        self.pruned_mentions = 0
+        self.generation = 0
+
+    def clear(self):
+        self.entries = {}
+        self.pruned_mentions = 0
+
+    def add(self, document, page, chunk, text, entity):
+        """Adds a mention. text is the (original) text of the chunk, the sample offsets are relative to it,
+        like the entity offsets of the output records."""
+        surface = entity["text"]
+        if entity.get("start") is not None and entity.get("end") is not None:
+            # the original casing, as the entity text may come from the lowercased chunk
+            surface = text[entity["start"]:entity["end"]] or surface
+        surface = POSSESSIVE_PATTERN.sub("", surface.strip())
+
+        name = normalize_name(surface)
+        if not name:
+            return
+
+        sample = None
+        if entity.get("start") is not None and entity.get("end") is not None:
+            sample = {"page": page, "chunk": chunk, "start": entity["start"], "end": entity["end"]}
+        self.add_entry(document, name, {"forms": {surface: 1}, "count": 1, "first_page": page, "last_page": page,
+                                        "samples": [sample] if sample is not None else []})
+
+    def add_entry(self, document, name, entry):
+        key = (document, name)
+        current = self.entries.get(key)
+        if current is None:
+            entry["samples"] = entry["samples"][:self.max_samples]
+            self.entries[key] = entry
+            if len(self.entries) > self.max_entries:
+                self.prune()
+            return
+
+        current["count"] += entry["count"]
+        current["first_page"] = min(current["first_page"], entry["first_page"])
+        current["last_page"] = max(current["last_page"], entry["last_page"])
+        for form, count in entry["forms"].items():
+            if form in current["forms"] or len(current["forms"]) < MAX_FORMS:
+                current["forms"][form] = current["forms"].get(form, 0) + count
+        if entry["samples"]:
+            samples = current["samples"] + [sample for sample in entry["samples"] if sample not in current["samples"]]
+            current["samples"] = sorted(samples, key=lambda sample: (sample["page"], sample["chunk"], sample["start"]))[:self.max_samples]
+
+    def prune(self):
+        """Drops the entries with the lowest counts, until a tenth of the space is free again."""
+        target = int(self.max_entries * 0.9)
+        by_count = sorted(self.entries.items(), key=lambda item: item[1]["count"])
+        for key, entry in by_count[:len(self.entries) - target]:
+            self.pruned_mentions += entry["count"]
+            del self.entries[key]
+
+    def merge(self, other):
+        """Adds all the entries of another index (e.g. of another worker) into this one."""
+        for (document, name), entry in other.entries.items():
+            self.add_entry(document, name, {"forms": dict(entry["forms"]), "count": entry["count"],
+                                            "first_page": entry["first_page"], "last_page": entry["last_page"],
+                                            "samples": list(entry["samples"])})
+        self.pruned_mentions += other.pruned_mentions
+
+    def documents(self):
+        """The index as {document: {name: {canonical, count, first_page, last_page, samples, forms}}},
+        the names of a document sorted by their mention count."""
+        documents = {}
+        for (document, name), entry in sorted(self.entries.items(), key=lambda item: (item[0][0], -item[1]["count"], item[0][1])):
+            documents.setdefault(document, {})[name] = {"canonical": max(entry["forms"], key=entry["forms"].get), **entry}
+
+        return documents
+
+    def save(self, path):
+        """Writes the index as JSON, or as SQLite for a .sqlite / .db path. The file is replaced atomically."""
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        if path.endswith((".sqlite", ".db")):
+            self.save_sqlite(path)
+        else:
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"documents": self.documents(), "pruned_mentions": self.pruned_mentions, "generation": self.generation},
+                          f, ensure_ascii=False)
+            os.replace(path + ".tmp", path)
+
+    def save_sqlite(self, path):
+        """Writes the index into the entities (one row per document and name) and samples tables of a SQLite file,
+        and the pruned mentions and the generation into the meta table."""
+        temp_path = path + ".tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+        db = sqlite3.connect(temp_path)
+        db.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        db.executemany("INSERT INTO meta VALUES (?, ?)", [("pruned_mentions", self.pruned_mentions), ("generation", self.generation)])
+        db.execute("CREATE TABLE entities (document TEXT NOT NULL, name TEXT NOT NULL, canonical TEXT NOT NULL, count INTEGER NOT NULL, "
+                   "first_page INTEGER NOT NULL, last_page INTEGER NOT NULL, forms TEXT NOT NULL, PRIMARY KEY (document, name))")
+        db.execute("CREATE TABLE samples (document TEXT NOT NULL, name TEXT NOT NULL, page INTEGER NOT NULL, chunk INTEGER NOT NULL, "
+                   "start INTEGER NOT NULL, end INTEGER NOT NULL)")
+        db.execute("CREATE INDEX entities_name ON entities (name)")
+        for document, names in self.documents().items():
+            for name, entry in names.items():
+                db.execute("INSERT INTO entities VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           (document, name, entry["canonical"], entry["count"], entry["first_page"], entry["last_page"],
+                            json.dumps(entry["forms"], ensure_ascii=False)))
+                db.executemany("INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?)",
+                               [(document, name, sample["page"], sample["chunk"], sample["start"], sample["end"])
+                                for sample in entry["samples"]])
+        db.commit()
+        db.close()
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path, max_entries=MAX_ENTRIES, max_samples=MAX_SAMPLES):
+        """Reads an index saved by save (JSON or SQLite)."""
+        index = cls(max_entries, max_samples)
+        if path.endswith((".sqlite", ".db")):
+            db = sqlite3.connect(path)
+            samples = {}
+            for document, name, page, chunk, start, end in db.execute("SELECT document, name, page, chunk, start, end FROM samples"):
+                samples.setdefault((document, name), []).append({"page": page, "chunk": chunk, "start": start, "end": end})
+            for document, name, count, first_page, last_page, forms in db.execute(
+                    "SELECT document, name, count, first_page, last_page, forms FROM entities"):
+                index.add_entry(document, name, {"forms": json.loads(forms), "count": count, "first_page": first_page,
+                                                 "last_page": last_page, "samples": samples.get((document, name), [])})
+            meta = dict(db.execute("SELECT key, value FROM meta"))
+            index.pruned_mentions = meta.get("pruned_mentions", 0)
+            index.generation = meta.get("generation", 0)
+            db.close()
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for document, names in data["documents"].items():
+                for name, entry in names.items():
+                    index.add_entry(document, name, {"forms": entry["forms"], "count": entry["count"], "first_page": entry["first_page"],
+                                                     "last_page": entry["last_page"], "samples": entry["samples"]})
+            index.pruned_mentions = data.get("pruned_mentions", 0)
+            index.generation = data.get("generation", 0)
+
+        return index
+
+    def print_stats(self):
+        documents = {document for document, _ in self.entries}
+        print(f"Entity index: {len(self.entries)} names in {len(documents)} documents, "
+              f"{sum(entry['count'] for entry in self.entries.values())} mentions ({self.pruned_mentions} pruned).")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merges entity indices (e.g. of parallel runs) into a single one.")
+    parser.add_argument('indices', nargs='+', help='JSON or SQLite entity indices to merge')
+    parser.add_argument('-o', '--output', required=True, help='path of the merged index (.json, or .sqlite / .db)')
+    args = parser.parse_args()
+
+    merged = EntityIndex()
+    for path in args.indices:
+        merged.merge(EntityIndex.load(path))
+    merged.save(args.output)
+    merged.print_stats()
+    print(f"Saved the merged index to {args.output}.")
@@ -0,0 +1,184 @@
+import asyncio
+import ollama
+import re
+import threading
+from metrics import metrics
+
+
+# global parameters
+KEEP_ALIVE = "1h"
+DEFAULT_NUM_CTX = 2048      # Ollama defaults, for options without num_ctx / num_predict
+DEFAULT_NUM_PREDICT = 128
+RETRY_BACKOFF = 1.0     # seconds, doubled after every failed attempt
+TOKENS_PER_WORD = 1.3   # rough estimation, good enough for budgeting a prompt
+PACKED_LINE_PATTERN = re.compile(r'^\[?(\d+)\]?\s*[:.)\-]\s*(.*)$')
+
+_local = threading.local()      # the event loop and the Ollama clients of a thread, reused by all its calls
+
+
+async def generate_one(client, semaphore, model, prompt, options, timeout, retries, reject_truncated=False):
+    """Sends a single prompt to Ollama, retrying with exponential backoff. Returns None if all attempts failed,
+    or, with reject_truncated, if the response was cut off by num_predict."""
+    backoff = RETRY_BACKOFF
+    for attempt in range(retries + 1):
+        try:
+            async with semaphore:
+                # the requests overlap, so only their wall time is meaningful
+                with metrics.stage("llm_request", cpu=False):
+                    res = await asyncio.wait_for(
+                        client.generate(model, prompt=prompt, stream=False, options=options, keep_alive=KEEP_ALIVE),
+                        timeout=timeout)
+            if reject_truncated and res.get("done_reason") == "length":
+                # a retry would be cut off as well
+                print("ERROR. the response was cut off by num_predict!")
+                return None
+            return str(res["response"]).strip()
+        except Exception as ex:
+            if attempt == retries:
+                print(f"Exception (while generating from prompt): {ex!r}, giving up after {attempt + 1} attempts!")
+                return None
+
+            print(f"Exception (while generating from prompt): {ex!r}, retrying in {backoff:.1f} seconds...")
+            await asyncio.sleep(backoff)
+            backoff *= 2
+
+##----------------------------------------##
+
+async def generate_all(client, prompts, model, options, concurrency=4, timeout=120.0, retries=2, reject_truncated=False):
+    """Sends all the prompts to Ollama with at most concurrency requests in flight. The responses keep the input order."""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    tasks = [generate_one(client, semaphore, model, prompt, options, timeout, retries, reject_truncated) for prompt in prompts]
+    return await asyncio.gather(*tasks)
+
+##----------------------------------------##
+
+def get_client(host=None):
+    """The event loop of the calling thread and its Ollama client for the host, created on first use. Both are
+    reused by the next calls of the thread, so the HTTP connections are kept alive from one page to the next."""
+    if getattr(_local, "loop", None) is None:
+        _local.loop = asyncio.new_event_loop()
+        _local.clients = {}
+    if host not in _local.clients:
+        _local.clients[host] = ollama.AsyncClient(host=host)
+
+    return _local.loop, _local.clients[host]
+
+##----------------------------------------##
+
+def generate(prompts, model, options, host=None, concurrency=4, timeout=120.0, retries=2, reject_truncated=False):
+    """Blocking wrapper around generate_all, to be called from the synchronous parts of the pipeline."""
+    loop, client = get_client(host)
+    return loop.run_until_complete(generate_all(client, prompts, model, options, concurrency, timeout, retries, reject_truncated))
+
+##----------------------------------------##
+
+def close():
+    """Closes the Ollama clients and the event loop of the calling thread."""
+    loop = getattr(_local, "loop", None)
+    if loop is None:
+        return
+
+    for client in _local.clients.values():
+        # the underlying httpx client, not every ollama version has a public close
+        http_client = getattr(client, "_client", None)
+        if http_client is not None:
+            loop.run_until_complete(http_client.aclose())
+    loop.close()
+    _local.loop = None
+
+##----------------------------------------##
+
+def estimate_tokens(text):
+    """Estimates the number of tokens of the text without running a tokenizer."""
+    return int(len(text.split()) * TOKENS_PER_WORD) + 1
+
+##----------------------------------------##
+
+def max_pack_budget(packed_prompt, options):
+    """The largest token budget of a pack that leaves room for the prompt and the response in the context window."""
+    return max(1, options.get("num_ctx", DEFAULT_NUM_CTX) - options.get("num_predict", DEFAULT_NUM_PREDICT)
+               - estimate_tokens(packed_prompt.format(input_text="")))
+
+##----------------------------------------##
+
+def pack_sentences(text, token_budget):
+    """Groups the sentences into packs that fit the token budget. Returns lists of sentence indices."""
+    packs = []
+    pack = []
+    pack_tokens = 0
+    for index, input_text in enumerate(text):
+        tokens = estimate_tokens(input_text) + 2  # the "[id] " prefix
+        if pack and pack_tokens + tokens > token_budget:
+            packs.append(pack)
+            pack = []
+            pack_tokens = 0
+
+        pack.append(index)
+        pack_tokens += tokens
+
+    if pack:
+        packs.append(pack)
+
+    return packs
+
+##----------------------------------------##
+
+def format_packed_input(text, pack):
+    """Numbers the sentences of the pack, starting from 1, one sentence per line."""
+    return "\n".join(f"[{number}] {text[index]}" for number, index in enumerate(pack, start=1))
+
+##----------------------------------------##
+
+def parse_packed_response(response, pack_size):
+    """Parses "<id>: <name>" lines into a list of names per sentence. Returns None if the response is malformed."""
+    outputs = [[] for _ in range(pack_size)]
+    for line in response.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        match = PACKED_LINE_PATTERN.match(line)
+        if match is None:
+            return None
+
+        number = int(match.group(1))
+        if number < 1 or number > pack_size:
+            return None
+
+        name = match.group(2).strip()
+        if name:
+            outputs[number - 1].append(name)
+
+    return ["\n".join(names) for names in outputs]
+
+##----------------------------------------##
+
+def generate_packed(text, prompt, packed_prompt, model, options, token_budget, host=None, concurrency=4, timeout=120.0, retries=2):
+    """Extracts from many sentences per request. Packs whose response can't be parsed, or was cut off by num_predict,
+    are re-sent one sentence at a time. The token budget is clamped, so a pack, the prompt and the response fit
+    into the context window."""
+    packs = pack_sentences(text, min(token_budget, max_pack_budget(packed_prompt, options)))
+    packed_prompts = [packed_prompt.format(input_text=format_packed_input(text, pack)) for pack in packs]
+    responses = generate(packed_prompts, model, options, host, concurrency, timeout, retries, reject_truncated=True)
+
+    outputs = [None] * len(text)
+    fallback = []
+    for pack, response in zip(packs, responses):
+        pack_outputs = parse_packed_response(response, len(pack)) if response is not None else None
+        if pack_outputs is None:
+            fallback += pack
+            continue
+
+        for index, output_text in zip(pack, pack_outputs):
+            outputs[index] = output_text
+
+    if fallback:
+        print(f"Could not parse {len(fallback)} packed sentences, falling back to single sentence requests.")
+        single_prompts = [prompt.format(input_text=text[index]) for index in fallback]
+        single_responses = generate(single_prompts, model, options, host, concurrency, timeout, retries)
+        for index, output_text in zip(fallback, single_responses):
+            outputs[index] = output_text
+
+    print(f"Sent {len(packs)} packed and {len(fallback)} single requests for {len(text)} sentences.")
+    return outputs
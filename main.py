@@ -1,10 +1,24 @@
 import argparse
 import fitz  # PyMuPDF
+import llm_client
+import multiprocessing
 import os
-import ollama
-import re
+import random
+import threading
+import time
+from sinks import JsonlSink, ParquetSink, make_record
+from result_cache import CACHE_MAX_MB, CACHE_PATH, ResultCache, make_key
+from chunking import WINDOW_SIZE, WINDOW_STRIDE, make_windows, merge_entities, split_sentences
+from concurrent.futures import ProcessPoolExecutor
+from dedup import ChunkDeduplicator, find_boilerplate, is_boilerplate
+from entity_index import EntityIndex
 from enum import Enum
-from gliner import GLiNER
+from manifest import MANIFEST_PATH, RunManifest
+from metrics import metrics, run_profiled
+from pipeline import bounded_map, prefetch
+from prefilter import NamePrefilter, has_capitalized_word, load_names
+from ner.backends import BACKENDS, configure_threads, load_model
+from server import HOST, MAX_BATCH_SIZE, MAX_WAIT, PORT, serve
 
 
 # global parameters
@@ -28,6 +42,26 @@ PROMPT = """
     **INPUT**
     TEXT: {input_text}
 """
+PACKED_PROMPT = """
+    **IDENTITY and PURPOSE**
+    You are a specialist in data engineering with advanced expertise in human names, including a degree in onomastics. Your task is to extract all human names from each of the following numbered sentences.
+
+    **OUTPUT INSTRUCTIONS**
+    - For each human name, print a separate line in the format `<sentence number>: <name>`.
+    - Include all names from all sentences; do not stop after the first.
+    - Skip the sentences without human names entirely.
+    - Return **only** these lines. Do not include any additional text, explanations, or formatting tags.
+    - If no human names are found at all, return absolutely nothing — no text, no spaces, no comments.
+    - Do not provide any explanations.
+
+    **EXAMPLES**
+    1: John Smith
+    1: Emma Williams
+    3: Liam Brown
+
+    **INPUT**
+    {input_text}
+"""
 MODEL = "gemma2"
 MODEL_OPTIONS = {
     # defined in https://github.com/ollama/ollama/blob/main/docs/modelfile.md
@@ -40,13 +74,20 @@ MODEL_OPTIONS = {
     'seed': 17,             # default is 0
     'stop': ['<|end_of_turn|>']
 }
+LLM_TIMEOUT = 120.0      # seconds per request
+LLM_RETRIES = 2
 INPUT_FOLDER = "input"
 INPUT_FILE_EXTENSION = ".pdf"
+DEFAULT_PAGE_RANGES = "2-3"     # the first two pages are skipped
+SAMPLING_SEED = 17
+PAGES_PER_TASK = 4      # pages read by a worker in a single task
+PREFETCH_GROUPS = 2     # groups of chunks read ahead of the inference
 
 class ParsingMethod(Enum):
     none = 'none'
     llm = 'llm'
     ner = 'ner'
+    cascade = 'cascade'
 
     def __str__(self):
         return self.value
@@ -55,6 +96,7 @@ class ReadingMethod(Enum):
     none = 'none'
     paragraph = 'paragraph'
     sentence = 'sentence'
+    page = 'page'
 
     def __str__(self):
         return self.value
@@ -67,140 +109,949 @@ class NerType(Enum):
     def __str__(self):
         return self.value
 
+DEFAULT_CHUNK_LIMITS = {
+    ReadingMethod.paragraph: 3,
+    ReadingMethod.sentence: 10,
+    ReadingMethod.page: 0,
+}
+NER_CHECKPOINTS = {
+    NerType.base: "urchade/gliner_medium-v2.1",
+    NerType.tuned: "models/checkpoint-510",
+}
+NER_LABELS = ["first_name"]
+NER_THRESHOLD = 0.5
+CASCADE_BAND = (0.3, 0.7)   # NER scores in this band are uncertain, such chunks are escalated to the LLM
+
+# loaded GLiNER models, keyed by (ner type, checkpoint, backend), kept warm for the whole run
+ner_models = {}
+# the CPU inference backend of the GLiNER models and its thread pools (0 - default)
+ner_backend = {"name": "torch", "intra_threads": 0, "inter_threads": 0}
+ner_timings = {"load": 0.0, "inference": 0.0, "chunks": 0}
+cascade_stats = {"chunks": 0, "escalated": 0, "failed": 0}
+
 ##----------------------------------------##
 
-def parse_text_llm(text):
-    for input_text in text:
-        print(f"input text: {input_text}")
-        prompt = PROMPT.format(input_text=input_text)
-        # print(f"complete prompt: {prompt}")
-
-        res = ollama.generate(MODEL, prompt=prompt, stream=False, options=MODEL_OPTIONS, keep_alive="1h")
-        # print("Response: " + str(res))
-        output_text = str(res["response"]).strip()
-        print(f"output text: {output_text}")
-        print("--")
+def load_ner_model(ner_type, checkpoint=None):
+    """Returns the GLiNER model of the given type, for the chosen backend. The model is loaded on first use and then reused."""
+    if checkpoint is None:
+        checkpoint = NER_CHECKPOINTS.get(ner_type)
+    if checkpoint is None:
+        print("ERROR. no NER model type was chosen!")
+        return None
+
+    key = (ner_type, checkpoint, ner_backend["name"])
+    if key not in ner_models:
+        start_time = time.perf_counter()
+        try:
+            ner_models[key] = load_model(checkpoint, ner_backend["name"], ner_type == NerType.tuned,
+                                         ner_backend["intra_threads"], ner_backend["inter_threads"])
+        except ImportError as ex:
+            print(f"ERROR. {ex}!")
+            return None
+        load_time = time.perf_counter() - start_time
+        ner_timings["load"] += load_time
+        metrics.record("ner_load", load_time)
+        print(f"Loaded the {checkpoint} model ({ner_backend['name']} backend) in {load_time:.2f} seconds.")
+
+    return ner_models[key]
 
 ##----------------------------------------##
 
-def parse_text_ner(text, ner_type):
-    labels = ["first_name"]
-    if ner_type == NerType.tuned:
-        trained_model = GLiNER.from_pretrained("models/checkpoint-510", load_tokenizer=True, local_files_only=True)
-    elif ner_type == NerType.base:
-        trained_model = GLiNER.from_pretrained("urchade/gliner_medium-v2.1")
+def warm_up_ner_model(ner_type, checkpoint=None):
+    """Loads the GLiNER model and runs a single dummy prediction, so the first page doesn't pay for it."""
+    trained_model = load_ner_model(ner_type, checkpoint)
+    if trained_model is None:
+        return None
+
+    start_time = time.perf_counter()
+    trained_model.predict_entities("John Smith went home.", NER_LABELS, threshold=NER_THRESHOLD)
+    print(f"Warmed up the NER model in {time.perf_counter() - start_time:.2f} seconds.")
+
+    return trained_model
+
+##----------------------------------------##
+
+def warm_up_llm(host=None):
+    """Sends an empty prompt, which makes Ollama load the model and keep it loaded for KEEP_ALIVE."""
+    start_time = time.perf_counter()
+    if llm_client.generate([""], MODEL, MODEL_OPTIONS, host, 1, LLM_TIMEOUT, 0)[0] is None:
+        return False
+
+    print(f"Warmed up the {MODEL} model in {time.perf_counter() - start_time:.2f} seconds.")
+    return True
+
+##----------------------------------------##
+
+def print_ner_timings():
+    chunks = ner_timings["chunks"]
+    inference = ner_timings["inference"]
+    print(f"NER model load time: {ner_timings['load']:.2f} seconds.")
+    print(f"NER inference time: {inference:.2f} seconds for {chunks} chunks "
+          f"({(inference / chunks if chunks else 0.0):.3f} seconds per chunk).")
+
+##----------------------------------------##
+
+def lookup_cache(text, cache, method, model, options, prompt="", exact=False):
+    """Returns the cache keys of the chunks and their cached results (None for every miss, or without a cache)."""
+    if cache is None:
+        return [None] * len(text), [None] * len(text)
+
+    keys = [make_key(input_text, method, model, options, prompt, exact) for input_text in text]
+    results = [cache.get(key) for key in keys]
+    cache.commit()
+    return keys, results
+
+##----------------------------------------##
+
+def parse_text_llm(text, concurrency=1, timeout=LLM_TIMEOUT, retries=LLM_RETRIES, host=None, pack_tokens=0, cache=None):
+    prompt = PACKED_PROMPT if pack_tokens > 0 else PROMPT
+    keys, outputs = lookup_cache(text, cache, ParsingMethod.llm.value, MODEL, MODEL_OPTIONS, prompt)
+    missing = [index for index, output_text in enumerate(outputs) if output_text is None]
+    missing_text = [text[index] for index in missing]
+
+    if not missing_text:
+        missing_outputs = []
+    elif pack_tokens > 0:
+        missing_outputs = llm_client.generate_packed(missing_text, PROMPT, PACKED_PROMPT, MODEL, MODEL_OPTIONS, pack_tokens,
+                                                     host, concurrency, timeout, retries)
     else:
-        print("ERROR. no NER model type was chosen!")
-        return
+        prompts = [PROMPT.format(input_text=input_text) for input_text in missing_text]
+        # print(f"complete prompts: {prompts}")
+        missing_outputs = llm_client.generate(prompts, MODEL, MODEL_OPTIONS, host, concurrency, timeout, retries)
+
+    for index, output_text in zip(missing, missing_outputs):
+        outputs[index] = output_text
+        if cache is not None and output_text is not None:
+            cache.put(keys[index], output_text)
+    if cache is not None and missing:
+        cache.commit()
+
+    return outputs
 
+##----------------------------------------##
+
+def make_batches(text, batch_size, batch_tokens=0, get_text=None):
+    """Splits the chunks into batches of at most batch_size chunks and, if batch_tokens is set, at most batch_tokens words.
+    get_text maps an item to its text, when the items aren't the chunks themselves."""
+    batches = []
+    batch = []
+    batch_words = 0
     for input_text in text:
-        print(f"input text:\n{input_text}")
-        entities = trained_model.predict_entities(input_text, labels, threshold=0.5)
+        words_counter = len((get_text(input_text) if get_text else input_text).split())
+        if batch and (len(batch) >= batch_size or (batch_tokens > 0 and batch_words + words_counter > batch_tokens)):
+            batches.append(batch)
+            batch = []
+            batch_words = 0
 
-        output_text = ""
-        for ent in entities:
-            print(ent["text"], "=>", ent["label"], "=>", ent["score"])
-            if bool(output_text):
-                output_text += "\n"
-            output_text += ent["text"]
+        batch.append(input_text)
+        batch_words += words_counter
 
-        print(f"output text:\n{output_text}")
-        print("--")
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+##----------------------------------------##
+
+def predict_ner_batch(trained_model, batch, threshold=NER_THRESHOLD):
+    """Runs the model over a batch of chunks and returns a list of entities for each chunk, in the same order."""
+    start_time = time.perf_counter()
+    with metrics.stage("ner_inference"):
+        if len(batch) == 1:
+            batch_entities = [trained_model.predict_entities(batch[0], NER_LABELS, threshold=threshold)]
+        else:
+            batch_entities = trained_model.batch_predict_entities(batch, NER_LABELS, threshold=threshold)
+    ner_timings["inference"] += time.perf_counter() - start_time
+    ner_timings["chunks"] += len(batch)
+
+    return batch_entities
 
 ##----------------------------------------##
 
-def parse_args():
+def parse_text_ner(text, ner_type, checkpoint=None, batch_size=1, batch_tokens=0, cache=None, threshold=NER_THRESHOLD,
+                   window_size=WINDOW_SIZE, window_stride=WINDOW_STRIDE):
+    """Long chunks are split into overlapping windows, so nothing is truncated by the model. The entities of
+    the windows are merged back, with offsets in the chunk text."""
+    if checkpoint is None:
+        checkpoint = NER_CHECKPOINTS.get(ner_type)
+
+    windows = []
+    for chunk_index, input_text in enumerate(text):
+        windows += [(chunk_index, offset, window_text) for offset, window_text in make_windows(input_text, window_size, window_stride)]
+    window_text = [window[2] for window in windows]
+
+    options = {"labels": NER_LABELS, "threshold": threshold, "backend": ner_backend["name"]}
+    # the entity offsets refer to the raw window text, so the key can't ignore its white spaces
+    keys, window_entities = lookup_cache(window_text, cache, ParsingMethod.ner.value, checkpoint, options, exact=True)
+    missing = [index for index, entities in enumerate(window_entities) if entities is None]
+
+    if missing:
+        trained_model = load_ner_model(ner_type, checkpoint)
+        if trained_model is None:
+            return None
+
+        for batch in make_batches(missing, batch_size, batch_tokens, lambda index: window_text[index]):
+            batch_entities = predict_ner_batch(trained_model, [window_text[index] for index in batch], threshold)
+            for index, entities in zip(batch, batch_entities):
+                window_entities[index] = entities
+                if cache is not None:
+                    cache.put(keys[index], entities)
+            if cache is not None:
+                cache.commit()
+
+    all_entities = [[] for _ in text]
+    windows_per_chunk = [0] * len(text)
+    for (chunk_index, offset, _), entities in zip(windows, window_entities):
+        windows_per_chunk[chunk_index] += 1
+        all_entities[chunk_index] += [dict(ent, start=ent["start"] + offset, end=ent["end"] + offset) for ent in entities]
+
+    return [merge_entities(input_text, entities) if windows_counter > 1 else entities
+            for input_text, entities, windows_counter in zip(text, all_entities, windows_per_chunk)]
+
+##----------------------------------------##
+
+def names_to_entities(output_text, input_text, source=None):
+    """Turns the names returned by the LLM into entities without a score. The offsets are the first
+    (case insensitive) occurrence of the name in the input text, or None if the LLM didn't copy it exactly."""
+    entities = []
+    lower_text = input_text.lower()
+    for name in (output_text or "").splitlines():
+        name = name.strip()
+        if not name:
+            continue
+
+        start = lower_text.find(name.lower())
+        ent = {"text": name, "label": NER_LABELS[0], "score": None,
+               "start": start if start >= 0 else None, "end": start + len(name) if start >= 0 else None}
+        if source is not None:
+            ent["source"] = source
+        entities.append(ent)
+
+    return entities
+
+##----------------------------------------##
+
+def needs_escalation(entities, original_text, band=CASCADE_BAND):
+    """Whether the NER result of a chunk is uncertain: some score is in the band, or there are no entities
+    although the original text has capitalized words that may be names."""
+    if not entities:
+        return has_capitalized_word(original_text)
+
+    return any(band[0] <= ent["score"] < band[1] for ent in entities)
+
+##----------------------------------------##
+
+def parse_text_cascade(text, original_text, args, cache=None):
+    """Runs the NER model first and sends only the chunks with an uncertain result to the LLM.
+    The names found by the LLM are returned as entities without a score. A chunk the LLM failed on keeps
+    its NER entities that reach the NER threshold."""
+    band = tuple(args.cascade_band)
+    all_entities = parse_text_ner(text, args.ner_type, args.ner_checkpoint, args.batch_size, args.batch_tokens, cache,
+                                  band[0], args.window_size, args.window_stride)
+    if all_entities is None:
+        return None
+
+    escalated = [index for index, entities in enumerate(all_entities) if needs_escalation(entities, original_text[index], band)]
+    cascade_stats["chunks"] += len(text)
+    cascade_stats["escalated"] += len(escalated)
+
+    outputs = []
+    if escalated:
+        outputs = parse_text_llm([text[index] for index in escalated], args.concurrency, args.llm_timeout, args.llm_retries,
+                                 args.ollama_host, args.pack_tokens, cache)
+
+    for index, output_text in zip(escalated, outputs):
+        if output_text is None:
+            cascade_stats["failed"] += 1
+            all_entities[index] = [ent for ent in all_entities[index] if ent["score"] >= NER_THRESHOLD]
+        else:
+            all_entities[index] = names_to_entities(output_text, text[index], ParsingMethod.llm.value)
+
+    return all_entities
+
+##----------------------------------------##
+
+def print_cascade_stats():
+    chunks = cascade_stats["chunks"]
+    escalated = cascade_stats["escalated"]
+    print(f"Cascade escalated {escalated} of {chunks} chunks to the LLM "
+          f"({(100.0 * escalated / chunks if chunks else 0.0):.1f}%), saving {chunks - escalated} LLM calls.")
+    if cascade_stats["failed"]:
+        print(f"WARNING. the LLM failed on {cascade_stats['failed']} escalated chunks, they kept their NER entities.")
+
+##----------------------------------------##
+
+def parse_text(text, args, cache=None, original_text=None):
+    """Sends the chunks to the chosen parsing method. Returns a result for each chunk, or None on error.
+    original_text is the text of the chunks before lowercasing, used by the cascade."""
+    if args.parsing_method == ParsingMethod.llm:
+        return parse_text_llm(text, args.concurrency, args.llm_timeout, args.llm_retries, args.ollama_host,
+                              args.pack_tokens, cache)
+    elif args.parsing_method == ParsingMethod.ner:
+        return parse_text_ner(text, args.ner_type, args.ner_checkpoint, args.batch_size, args.batch_tokens, cache,
+                              NER_THRESHOLD, args.window_size, args.window_stride)
+    elif args.parsing_method == ParsingMethod.cascade:
+        return parse_text_cascade(text, original_text or text, args, cache)
+    else:
+        print("ERROR. no parsing method has been chosen!")
+        return None
+
+##----------------------------------------##
+
+def chunk_limit_type(value):
+    """Parses the per page chunk limit: a positive number, or "all" for no limit."""
+    if value == "all":
+        return 0
+
+    limit = int(value)
+    if limit <= 0:
+        raise argparse.ArgumentTypeError("the chunk limit must be a positive number or 'all'")
+    return limit
+
+##----------------------------------------##
+
+def page_ranges_type(value):
+    """Checks the page ranges, such as "2-10,15,20-": zero based page indices, and no range ending before it starts."""
+    page_ranges = [page_range.strip() for page_range in value.split(",") if page_range.strip()]
+    if not page_ranges:
+        raise argparse.ArgumentTypeError("no page range given")
+
+    for page_range in page_ranges:
+        first, _, last = page_range.partition("-")
+        try:
+            first = int(first) if first.strip() else 0
+            last = int(last) if last.strip() else None
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid page range '{page_range}', expected e.g. \"2-10,15,20-\"")
+        if first < 0 or (last is not None and last < first):
+            raise argparse.ArgumentTypeError(f"the page range '{page_range}' selects no pages")
+    return value
+
+##----------------------------------------##
+
+def parse_args(argv=None):
     parser = argparse.ArgumentParser()
 
     parser.add_argument("-pm", "--parsing_method", required=True, type=ParsingMethod, choices=list(ParsingMethod), help='TODO')
     parser.add_argument('-rm', '--reading_method', required=True, type=ReadingMethod, choices=list(ReadingMethod), help='TODO')
     parser.add_argument('-nt', '--ner_type', required=True, type=NerType, choices=list(NerType), help='TODO')
+    parser.add_argument('-p', '--pages', default=DEFAULT_PAGE_RANGES, type=page_ranges_type, help='zero based page ranges to read, e.g. "2-10,15,20-" (an open range ends at the last page)')
+    parser.add_argument('-cl', '--chunk_limit', default=None, type=chunk_limit_type, help='maximal number of chunks read from a page, or "all" (defaults to 3 paragraphs or 10 sentences)')
+    parser.add_argument('-s', '--sample', default=0, type=int, help='read only a stratified random sample of this many pages of every document')
+    parser.add_argument('--seed', default=SAMPLING_SEED, type=int, help='seed of the page sampling')
+    parser.add_argument('--cascade_band', nargs=2, default=list(CASCADE_BAND), type=float, metavar=('LOW', 'HIGH'), help='NER scores escalated to the LLM by the cascade parsing method')
+    parser.add_argument('-dd', '--dedup', action='store_true', help='parse every distinct chunk of the run once, its duplicates get the same result')
+    parser.add_argument('--near_duplicates', default=0.0, type=float, help='also treat chunks with this MinHash similarity (e.g. 0.9) as duplicates, implies --dedup')
+    parser.add_argument('-sh', '--strip_headers', action='store_true', help='strip the page headers and footers repeated across the pages of a document')
+    parser.add_argument('-pf', '--prefilter', action='store_true', help='skip the model for the chunks without any name candidates')
+    parser.add_argument('--names', nargs='*', default=[], help='files with additional names for the prefilter, one name per line')
+    parser.add_argument('-ws', '--window_size', default=WINDOW_SIZE, type=int, help='maximal number of words in a single NER window, counted like GLiNER does (punctuation marks are words), longer chunks are split (0 - no splitting)')
+    parser.add_argument('--window_stride', default=WINDOW_STRIDE, type=int, help='number of words between the starts of two NER windows')
+    parser.add_argument('-bs', '--batch_size', default=1, type=int, help='number of chunks sent to the NER model in a single batch')
+    parser.add_argument('-bt', '--batch_tokens', default=0, type=int, help='maximal number of words in a single NER batch (0 - no limit)')
+    parser.add_argument('-bp', '--batch_pages', default=1, type=int, help='number of pages whose chunks are collected before parsing them')
+    parser.add_argument('-c', '--concurrency', default=1, type=int, help='maximal number of LLM requests in flight')
+    parser.add_argument('--llm_timeout', default=LLM_TIMEOUT, type=float, help='timeout of a single LLM request, in seconds')
+    parser.add_argument('--llm_retries', default=LLM_RETRIES, type=int, help='number of retries of a failed LLM request')
+    parser.add_argument('-pt', '--pack_tokens', default=0, type=int, help='token budget of the sentences packed into a single LLM request (0 - one sentence per request)')
+    parser.add_argument('--ollama_host', default=None, help='Ollama server address (defaults to OLLAMA_HOST or the local server)')
+    parser.add_argument('-w', '--workers', default=1, type=int, help='number of worker processes reading the documents')
+    parser.add_argument('-o', '--output', default=None, help='path of a JSONL file with a record of every chunk')
+    parser.add_argument('--parquet', default=None, help='path of a Parquet file with a record of every chunk (requires pyarrow)')
+    parser.add_argument('-ix', '--index', default=None, help='path of a per document index of the names (mention counts, pages, sample offsets), .json or .sqlite')
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not print the chunks and their results')
+    parser.add_argument('-r', '--resume', action='store_true', help='skip the pages completed by a previous run with the same configuration')
+    parser.add_argument('--manifest', default=MANIFEST_PATH, help='path of the run manifest, which records the completed pages')
+    parser.add_argument('-m', '--metrics', action='store_true', help='print per stage timings, throughput and memory at the end of the run')
+    parser.add_argument('--metrics_output', default=None, help='path of a JSON file with the metrics of the run')
+    parser.add_argument('--profile', default=None, help='profile the processing and save the profile to this path')
+    parser.add_argument('--profiler', default='cprofile', choices=['cprofile', 'pyinstrument'], help='profiler used by --profile')
+    parser.add_argument('--no_cache', action='store_true', help='do not read or write the persistent result cache')
+    parser.add_argument('--cache_path', default=CACHE_PATH, help='path of the persistent result cache')
+    parser.add_argument('--cache_size', default=CACHE_MAX_MB, type=int, help='maximal size of the persistent result cache, in MB')
+    parser.add_argument('-nb', '--ner_backend', default='torch', choices=BACKENDS, help='CPU inference backend of the NER model (the onnx ones need ner/export_model.py first)')
+    parser.add_argument('--intra_threads', default=0, type=int, help='threads used within a single NER operator (0 - default)')
+    parser.add_argument('--inter_threads', default=0, type=int, help='threads used between NER operators (0 - default)')
+    parser.add_argument('-nc', '--ner_checkpoint', default=None, help='overrides the checkpoint (path or hub name) of the chosen NER model type')
+    parser.add_argument('--serve', action='store_true', help='keep the models loaded and serve the extraction over a local HTTP API instead of reading the input folder')
+    parser.add_argument('--host', default=HOST, help='address the server listens on')
+    parser.add_argument('--port', default=PORT, type=int, help='port the server listens on')
+    parser.add_argument('--max_batch', default=MAX_BATCH_SIZE, type=int, help='maximal number of chunks of concurrent requests parsed in a single batch by the server')
+    parser.add_argument('--max_wait', default=MAX_WAIT * 1000, type=float, help='time a server batch waits for more chunks, in milliseconds')
 
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 ##----------------------------------------##
 
-def main():
-    args = parse_args()
+def extract_text(doc, page_indices, reading_method, boilerplate=None):
+    """Text extraction stage. Yields the raw text pieces of every page with their offsets in the page text:
+    its blocks (the page text is then the blocks one after another), or its whole text.
+    The boilerplate blocks (repeated headers and footers) are left out, the page text is then made of the other blocks."""
+    for page_index in page_indices:
+        page = doc[page_index]
+        if reading_method == ReadingMethod.paragraph or boilerplate:
+            pieces = []
+            offset = 0
+            for block in page.get_text("blocks"):
+                if boilerplate and is_boilerplate(block, boilerplate, page.rect.height):
+                    continue
+                # the page text of get_text() has no image blocks, a rebuilt one has none either
+                if reading_method != ReadingMethod.paragraph and block[6] != 0:
+                    continue
+                pieces.append((offset, block[4]))
+                offset += len(block[4])
+            if reading_method == ReadingMethod.paragraph:
+                yield page_index, pieces
+            else:
+                yield page_index, [(0, "".join(piece for _, piece in pieces))]
+        else:
+            yield page_index, [(0, page.get_text())]
+
+##----------------------------------------##
+
+def split_chunks(pages, reading_method):
+    """Chunker stage. Yields the paragraphs, the sentences or the whole text of every page, with their offsets in the page text."""
+    for page_index, pieces in pages:
+        for offset, piece in pieces:
+            if reading_method == ReadingMethod.sentence:
+                for start, end in split_sentences(piece):
+                    yield page_index, offset + start, offset + end, piece[start:end]
+            else:
+                yield page_index, offset, offset + len(piece), piece
+
+##----------------------------------------##
+
+def normalize_chunks(chunks, reading_method, file_path, chunk_limit=None):
+    """Normalizer stage. Cleans the chunks up, drops the short ones and yields at most chunk_limit chunks per page.
+    chunk_limit is the default limit of the reading method when None, and no limit at all when 0.
+    Whole pages are kept as they are, so the entity offsets point into the page text."""
+    if chunk_limit is None:
+        chunk_limit = DEFAULT_CHUNK_LIMITS[reading_method]
+
+    current_page = None
+    page_chunks = 0
+    for page_index, start, end, chunk in chunks:
+        if page_index != current_page:
+            current_page = page_index
+            page_chunks = 0
+
+        # remove line breaks (new lines)
+        original_words = chunk.replace('\n', ' ').replace('\r', '').replace('  ', ' ').split()
+        words_counter = len(original_words)
+        # clear chunks under 2 words
+        if words_counter <= 2:
+            continue
+
+        if chunk_limit and page_chunks >= chunk_limit:
+            continue
+
+        # the original (not lowercased) text is kept for the capitalization heuristics
+        original_text = chunk if reading_method == ReadingMethod.page else " ".join(original_words)
+        text = original_text.lower() if reading_method == ReadingMethod.sentence else original_text
+        yield {"file": file_path, "page": page_index, "index": page_chunks, "start": start, "end": end,
+               "text": text, "original_text": original_text}
+        page_chunks += 1
 
-    for file_name in os.listdir(INPUT_FOLDER):
+##----------------------------------------##
+
+def timed_stage(timings, name, items):
+    """Runs a stage over all the items and, unless timings is None, appends its (name, wall, CPU) times.
+    The CPU time is the one of the current thread, as the reading stages run in their own thread or process."""
+    if timings is None:
+        return list(items)
+
+    start_wall = time.perf_counter()
+    start_cpu = time.thread_time()
+    items = list(items)
+    timings.append((name, time.perf_counter() - start_wall, time.thread_time() - start_cpu))
+    return items
+
+##----------------------------------------##
+
+def read_pages(file_path, page_indices, reading_method, chunk_limit=None, timed=False, boilerplate=None):
+    """Reads the chunks of the given pages. Runs in a worker process, which has to open its own copy of the document.
+    Only the given pages are loaded from the document. Returns the chunks and, if timed, the times of the stages,
+    as the metrics of a worker process are not shared."""
+    timings = [] if timed else None
+    with fitz.open(file_path) as doc:
+        pages = timed_stage(timings, "pdf_extract", extract_text(doc, page_indices, reading_method, boilerplate))
+        chunks = timed_stage(timings, "chunk_split", split_chunks(pages, reading_method))
+        chunks = timed_stage(timings, "normalize", normalize_chunks(chunks, reading_method, file_path, chunk_limit))
+
+    return chunks, timings or []
+
+##----------------------------------------##
+
+def parse_page_ranges(page_ranges, page_count):
+    """Parses page ranges such as "2-10,15,20-" into a sorted list of page indices (zero based, inclusive ranges)."""
+    page_indices = set()
+    for page_range in page_ranges.split(","):
+        page_range = page_range.strip()
+        if not page_range:
+            continue
+
+        if "-" in page_range:
+            first, last = page_range.split("-", 1)
+            first = int(first) if first.strip() else 0
+            last = int(last) if last.strip() else page_count - 1
+        else:
+            first = last = int(page_range)
+
+        page_indices.update(range(max(first, 0), min(last, page_count - 1) + 1))
+
+    return sorted(page_indices)
+
+##----------------------------------------##
+
+def sample_pages(page_indices, sample_size, seed):
+    """Picks a random page out of each of sample_size equal strata of the pages, so the sample covers the whole book."""
+    if sample_size <= 0 or sample_size >= len(page_indices):
+        return page_indices
+
+    rand = random.Random(seed)
+    sample = []
+    for stratum in range(sample_size):
+        start = stratum * len(page_indices) // sample_size
+        end = (stratum + 1) * len(page_indices) // sample_size
+        sample.append(page_indices[rand.randrange(start, end)])
+
+    return sample
+
+##----------------------------------------##
+
+def select_pages(file_path, page_count, page_ranges=DEFAULT_PAGE_RANGES, sample_size=0, seed=SAMPLING_SEED):
+    """Returns the indices of the pages of the document to read."""
+    page_indices = parse_page_ranges(page_ranges, page_count)
+    return sample_pages(page_indices, sample_size, f"{seed}-{os.path.basename(file_path)}")
+
+##----------------------------------------##
+
+def page_source(page_ranges=DEFAULT_PAGE_RANGES, sample_size=0, seed=SAMPLING_SEED, manifest=None, strip_headers=False):
+    """Page source stage. Yields the input documents split into page ranges, in a deterministic order, together
+    with the repeated headers and footers of the document to strip (if strip_headers).
+    The pages completed by a previous run (according to the manifest) are skipped."""
+    for file_name in sorted(os.listdir(INPUT_FOLDER)):
         if file_name.endswith(INPUT_FILE_EXTENSION):
-            print(f"Process the {file_name} file.")
             full_input_path = os.path.join(INPUT_FOLDER, file_name)
+            with fitz.open(full_input_path) as doc:
+                page_indices = select_pages(full_input_path, doc.page_count, page_ranges, sample_size, seed)
+                boilerplate = find_boilerplate(doc) if strip_headers else frozenset()
+            if boilerplate:
+                print(f"Stripping {len(boilerplate)} repeated headers and footers from {file_name}.")
 
-            doc = fitz.open(full_input_path)
+            if manifest is not None:
+                completed_pages = manifest.completed_pages(full_input_path)
+                page_indices = [page_index for page_index in page_indices if page_index not in completed_pages]
 
-            print("*Start*")
-            total_pages_to_read = 2
-            for page_index, page in enumerate(doc.pages()):
-                if page_index == 0:
-                    print("-Skipping first page-")
-                    continue
-                elif page_index == 1:
-                    print("-Skipping second page-")
-                    continue
-                elif page_index < (total_pages_to_read + 2):
-                    print(f"-Reading the {page_index} page-")
-                    input_text = []
-                    if args.reading_method == ReadingMethod.paragraph:
-                        paragraphs = page.get_text("blocks")
-
-                        total_paragraphs_to_read = 3
-                        for paragraph in paragraphs:
-                            paragraph = paragraph[4].replace('\n', ' ').replace('\r', '').replace('  ', ' ')
-
-                            words = paragraph.split()
-                            words_counter = len(words)
-                            # clear paragraphs under 2 words
-                            if words_counter <= 2:
-                                continue
-
-                            # print(f"Paragraph has {words_counter} words.")
-                            paragraph = " ".join(words)
-                            # print(paragraph)
-
-                            total_paragraphs_to_read -= 1
-                            if total_paragraphs_to_read < 0:
-                                break
-
-                            input_text.append(paragraph)
-                    elif args.reading_method == ReadingMethod.sentence:
-                        sentences = re.findall(r'([^.!?]*[.!?])', page.get_text())
-
-                        total_sentences_to_read = 10
-                        for sentence in sentences:
-                            # remove line breaks (new lines)
-                            sentence = sentence.replace('\n', ' ').replace('\r', '').replace('  ', ' ').strip().lower()
-
-                            words = sentence.split()
-                            words_counter = len(words)
-                            # clear sentences under 2 words
-                            if words_counter <= 2:
-                                continue
-
-                            # print(f"Sentence has {words_counter} words.")
-                            sentence = " ".join(words)
-                            # print(sentence)
-
-                            total_sentences_to_read -= 1
-                            if total_sentences_to_read < 0:
-                                break
-
-                            input_text.append(sentence)
-                    else:
-                        print("ERROR. no reading method has been chosen!")
-                        return
-
-                    if args.parsing_method == ParsingMethod.llm:
-                        parse_text_llm(input_text)
-                    elif args.parsing_method == ParsingMethod.ner:
-                        parse_text_ner(input_text, args.ner_type)
-                    else:
-                        print("ERROR. no parsing method has been chosen!")
-                        return
-                else:
-                    print("*Stop*")
-                    break
+            for start in range(0, len(page_indices), PAGES_PER_TASK):
+                yield full_input_path, page_indices[start:start + PAGES_PER_TASK], boilerplate
+
+##----------------------------------------##
+
+def read_tasks(tasks, reading_method, chunk_limit=None, executor=None, window=1):
+    """Yields the chunks of every task, reading them in the worker processes when there is an executor.
+    At most window tasks are read ahead of the consumer."""
+    tasks = ((file_path, page_indices, reading_method, chunk_limit, metrics.enabled, boilerplate)
+             for file_path, page_indices, boilerplate in tasks)
+    if executor is None:
+        results = (read_pages(*task) for task in tasks)
+    else:
+        results = bounded_map(executor, read_pages, tasks, window)
+
+    for chunks, timings in results:
+        for timing in timings:
+            metrics.record(*timing)
+        yield from chunks
+
+##----------------------------------------##
+
+def group_chunks(chunks, batch_pages):
+    """Collects the chunks of up to batch_pages pages of the same document into a single group."""
+    group = []
+    group_pages = set()
+    for chunk in chunks:
+        page_key = (chunk["file"], chunk["page"])
+        if group and (chunk["file"] != group[0]["file"] or (page_key not in group_pages and len(group_pages) >= batch_pages)):
+            yield group
+            group = []
+            group_pages = set()
+
+        group.append(chunk)
+        group_pages.add(page_key)
+
+    if group:
+        yield group
+
+##----------------------------------------##
+
+def prefilter_chunks(chunks, name_prefilter):
+    """Prefilter stage. Marks the chunks that clearly have no names, so the extractor doesn't send them to the model."""
+    for chunk in chunks:
+        chunk["candidates"] = name_prefilter.check(chunk["text"], chunk["original_text"])
+        yield chunk
+
+##----------------------------------------##
+
+def extract_results(groups, args, cache=None, deduplicator=None):
+    """Extractor stage. Yields every chunk together with its result. Chunks without name candidates get an empty result.
+    With a deduplicator, only the first occurrence of a (near) duplicate chunk is parsed, the others get its result."""
+    empty_result = "" if args.parsing_method == ParsingMethod.llm else []
+    for group in groups:
+        candidates = [chunk for chunk in group if chunk.get("candidates", True)]
+        start_time = time.perf_counter()
+        if deduplicator is not None:
+            keys, new_indices = deduplicator.assign([chunk["text"] for chunk in candidates])
+            new_chunks = [candidates[index] for index in new_indices]
+            metrics.count("dedup_saved", len(candidates) - len(new_chunks))
+        else:
+            new_chunks = candidates
+        results = parse_text([chunk["text"] for chunk in new_chunks], args, cache,
+                             [chunk["original_text"] for chunk in new_chunks]) if new_chunks else []
+        if results is None:
+            if deduplicator is not None:
+                deduplicator.discard([keys[index] for index in new_indices])
+            return
+        if deduplicator is not None:
+            deduplicator.complete([keys[index] for index in new_indices], results)
+            results = [deduplicator.result(key, chunk["text"]) for key, chunk in zip(keys, candidates)]
+            # a failed chunk is parsed again when it occurs later
+            deduplicator.discard([keys[index] for index in new_indices if results[index] is None])
+        # the chunks are processed in batches, so only the average latency of a chunk is known
+        elapsed = time.perf_counter() - start_time
+        latency = elapsed / len(candidates) if candidates else 0.0
+        metrics.record("extract", elapsed)
+        metrics.count("chunks", len(group))
+        if metrics.enabled:
+            metrics.count("tokens", sum(llm_client.estimate_tokens(chunk["text"]) for chunk in group))
+
+        results = iter(results)
+        for chunk in group:
+            chunk["latency"] = latency if chunk.get("candidates", True) else 0.0
+            yield chunk, next(results) if chunk.get("candidates", True) else empty_result
+
+##----------------------------------------##
+
+def print_results(results, parsing_method):
+    """Sink stage. Prints the chunks and their extracted names, and passes the results on."""
+    current_file = None
+    current_page = None
+    for chunk, result in results:
+        if chunk["file"] != current_file:
+            current_file = chunk["file"]
+            current_page = None
+            print(f"Process the {os.path.basename(current_file)} file.")
+        if chunk["page"] != current_page:
+            current_page = chunk["page"]
+            print(f"-Reading the {current_page} page-")
+
+        if parsing_method == ParsingMethod.llm:
+            print(f"input text: {chunk['text']}")
+            if result is None:
+                print("ERROR. no response from the LLM!")
+                result = ""
+            print(f"output text: {result}")
+        else:
+            print(f"input text:\n{chunk['text']}")
+
+            output_text = ""
+            for ent in result:
+                print(ent["text"], "=>", ent["label"], "=>", ent["score"])
+                if bool(output_text):
+                    output_text += "\n"
+                output_text += ent["text"]
+
+            print(f"output text:\n{output_text}")
+        print("--")
+
+        yield chunk, result
+
+##----------------------------------------##
+
+def model_name(args):
+    """The name of the model(s) behind the results, for the output records."""
+    checkpoint = args.ner_checkpoint or NER_CHECKPOINTS.get(args.ner_type)
+    if args.ner_backend != "torch":
+        checkpoint = f"{checkpoint}:{args.ner_backend}"
+    if args.parsing_method == ParsingMethod.llm:
+        return MODEL
+    elif args.parsing_method == ParsingMethod.cascade:
+        return f"{checkpoint}+{MODEL}"
+    return checkpoint
+
+##----------------------------------------##
+
+def write_results(results, sinks, args, manifest=None, entity_index=None):
+    """Sink stage. Writes a record of every chunk into the output files, folds its names into the entity index,
+    and marks the written pages as completed. The records and the names of a page are held back until the page is
+    completed, so the outputs and the index saved with the manifest cover exactly the completed pages. A page with
+    a chunk the LLM failed on is dropped and not completed, so a resumed run parses the page again."""
+    model = model_name(args)
+    page_entities = EntityIndex() if entity_index is not None else None
+    page_records = []
+    current_page = None
+    failed_chunks = 0
+
+    def complete_page(page, failed_chunks):
+        if failed_chunks:
+            print(f"ERROR. the LLM failed on {failed_chunks} chunks of the {page[1]} page of {os.path.basename(page[0])}, "
+                  f"the page is left for a resumed run!")
+        else:
+            with metrics.stage("sink"):
+                for record in page_records:
+                    for sink in sinks:
+                        sink.write(record)
+            if entity_index is not None:
+                entity_index.merge(page_entities)
+            if manifest is not None:
+                manifest.complete_page(*page)
+
+        page_records.clear()
+        if entity_index is not None:
+            page_entities.clear()
+
+    for chunk, result in results:
+        if (chunk["file"], chunk["page"]) != current_page:
+            if current_page is not None:
+                complete_page(current_page, failed_chunks)
+            current_page = (chunk["file"], chunk["page"])
+            failed_chunks = 0
+            metrics.count("pages")
+
+        if result is None:
+            failed_chunks += 1
+            metrics.count("failed_chunks")
+            continue
+        if failed_chunks:
+            continue
+
+        if sinks or entity_index is not None:
+            entities = names_to_entities(result, chunk["text"]) if args.parsing_method == ParsingMethod.llm else result
+        if entity_index is not None:
+            with metrics.stage("index"):
+                for ent in entities:
+                    page_entities.add(os.path.basename(chunk["file"]), chunk["page"], chunk["index"], chunk["original_text"], ent)
+        if sinks:
+            page_records.append(make_record(chunk, entities, model, chunk.get("latency")))
+
+    if current_page is not None:
+        complete_page(current_page, failed_chunks)
+
+##----------------------------------------##
+
+def process_files(args, cache=None, name_prefilter=None, sinks=(), manifest=None, entity_index=None, deduplicator=None):
+    if args.reading_method not in (ReadingMethod.paragraph, ReadingMethod.sentence, ReadingMethod.page):
+        print("ERROR. no reading method has been chosen!")
+        return
+    if args.parsing_method not in (ParsingMethod.llm, ParsingMethod.ner, ParsingMethod.cascade):
+        print("ERROR. no parsing method has been chosen!")
+        return
+
+    executor = None
+    if args.workers > 1:
+        # the workers are started from the prefetch thread while the inference runs its own thread pools,
+        # forking such a process can deadlock, so they are started from a clean fork server (or spawned)
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        executor = ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context(start_method))
+    try:
+        # page source -> text extraction -> chunker -> normalizer (in the workers) -> extractor -> sink;
+        # the reading stages run ahead of the inference in a background thread, bounded by PREFETCH_GROUPS
+        tasks = page_source(args.pages, args.sample, args.seed, manifest, args.strip_headers)
+        chunks = read_tasks(tasks, args.reading_method, args.chunk_limit, executor, args.workers * 2)
+        if name_prefilter is not None:
+            chunks = prefilter_chunks(chunks, name_prefilter)
+        groups = prefetch(group_chunks(chunks, args.batch_pages), PREFETCH_GROUPS)
+        results = extract_results(groups, args, cache, deduplicator)
+        if not args.quiet:
+            results = print_results(results, args.parsing_method)
+        write_results(results, sinks, args, manifest, entity_index)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+##----------------------------------------##
+
+def serve_files(args, cache=None, name_prefilter=None):
+    """Serves the extraction of chunks and documents over HTTP (see server.py), with the models kept warm.
+    The chunks of concurrent requests are parsed together in micro-batches."""
+    empty_result = "" if args.parsing_method == ParsingMethod.llm else []
+    model = model_name(args)
+    # PyMuPDF isn't thread safe, the handler threads read one document at a time
+    document_lock = threading.Lock()
+
+    def process(text, original_text):
+        candidates = [name_prefilter is None or name_prefilter.check(input_text, original_input_text)
+                      for input_text, original_input_text in zip(text, original_text)]
+        selected = [index for index, candidate in enumerate(candidates) if candidate]
+        results = parse_text([text[index] for index in selected], args, cache,
+                             [original_text[index] for index in selected]) if selected else []
+        if results is None:
+            return None
+
+        all_results = [empty_result] * len(text)
+        for index, result in zip(selected, results):
+            all_results[index] = result
+        if args.parsing_method == ParsingMethod.llm:
+            # a failed LLM request gives null, so the client can tell it from a chunk without names
+            return [names_to_entities(result, input_text) if result is not None else None
+                    for input_text, result in zip(text, all_results)]
+        return all_results
+
+    def read_document(file_path, page_ranges=None):
+        if not os.path.isfile(file_path):
+            raise ValueError(f"there is no document at {file_path}")
+        try:
+            page_ranges = page_ranges_type(page_ranges) if page_ranges else None
+        except argparse.ArgumentTypeError as ex:
+            raise ValueError(str(ex))
+        with document_lock:
+            try:
+                with fitz.open(file_path) as doc:
+                    page_indices = select_pages(file_path, doc.page_count, page_ranges or args.pages, args.sample, args.seed)
+                    boilerplate = find_boilerplate(doc) if args.strip_headers else frozenset()
+            except RuntimeError as ex:
+                raise ValueError(f"can't open {file_path}: {ex}")
+
+            chunks, _ = read_pages(file_path, page_indices, args.reading_method, args.chunk_limit, False, boilerplate)
+        return chunks, make_records
+
+    def make_records(chunks, results):
+        return [make_record(chunk, result or [], model, None, "no response from the LLM" if result is None else None)
+                for chunk, result in zip(chunks, results)]
+
+    serve(process, read_document, args.host, args.port, args.max_batch, args.max_wait / 1000)
+
+##----------------------------------------##
+
+def run_config(args):
+    """Everything that affects the results of a page. A run can only be resumed with the same configuration,
+    the selected pages may change though."""
+    return {
+        "parsing_method": args.parsing_method,
+        "reading_method": args.reading_method,
+        "ner": args.ner_checkpoint or NER_CHECKPOINTS.get(args.ner_type),
+        "ner_threshold": NER_THRESHOLD,
+        "ner_backend": args.ner_backend,
+        "model": MODEL,
+        "model_options": MODEL_OPTIONS,
+        "chunk_limit": args.chunk_limit,
+        "window": [args.window_size, args.window_stride],
+        "pack_tokens": args.pack_tokens,
+        "cascade_band": args.cascade_band,
+        "prefilter": args.prefilter,
+        "names": args.names,
+        "strip_headers": args.strip_headers,
+        "dedup": [args.dedup or args.near_duplicates > 0, args.near_duplicates],
+    }
+
+##----------------------------------------##
+
+def main():
+    args = parse_args()
+
+    if args.metrics or args.metrics_output:
+        metrics.enable()
+
+    if args.pack_tokens > llm_client.max_pack_budget(PACKED_PROMPT, MODEL_OPTIONS):
+        print(f"WARNING. the pack budget is clamped to {llm_client.max_pack_budget(PACKED_PROMPT, MODEL_OPTIONS)} tokens, "
+              f"so the packs fit into the context window with the prompt and the response.")
+
+    ner_backend.update(name=args.ner_backend, intra_threads=args.intra_threads, inter_threads=args.inter_threads)
+    # the torch thread pools have to be set before any inference
+    configure_threads(args.intra_threads, args.inter_threads)
+
+    cache = None if args.no_cache else ResultCache(args.cache_path, args.cache_size)
+
+    # with the cache, the model is loaded lazily on the first miss, so unchanged documents don't pay for it;
+    # the server loads it at once, so the first request doesn't pay for it either
+    uses_ner = args.parsing_method in (ParsingMethod.ner, ParsingMethod.cascade)
+    if uses_ner and (cache is None or args.serve):
+        if warm_up_ner_model(args.ner_type, args.ner_checkpoint) is None:
+            return
+    if args.serve and args.parsing_method in (ParsingMethod.llm, ParsingMethod.cascade):
+        if not warm_up_llm(args.ollama_host):
+            print(f"WARNING. couldn't warm up the {MODEL} model, it is loaded on the first request.")
+
+    name_prefilter = NamePrefilter(load_names(args.names)) if args.prefilter else None
+
+    if args.serve:
+        # in server mode the models are used by the batch thread only, the batch size is set by --max_batch
+        args.batch_size = max(args.batch_size, args.max_batch)
+        try:
+            serve_files(args, cache, name_prefilter)
+        finally:
+            llm_client.close()
+            if cache is not None:
+                cache.print_stats()
+                cache.close()
+        return
+
+    manifest = RunManifest(args.manifest, run_config(args), args.resume)
+
+    # the index is saved with the manifest and covers the completed pages, a resumed run adds the names of its pages
+    # to it; an index of another flush than the manifest would count some pages twice or not at all
+    entity_index = None
+    if args.index:
+        entity_index = EntityIndex()
+        if manifest.documents:
+            if not os.path.exists(args.index):
+                print(f"ERROR. the entity index {args.index} of the interrupted run doesn't exist, run without --resume!")
+                return
+            entity_index = EntityIndex.load(args.index)
+            if entity_index.generation != manifest.generation:
+                print(f"ERROR. the entity index {args.index} doesn't match the manifest {args.manifest}, run without --resume!")
+                return
+        manifest.indices.append((entity_index, args.index))
+
+    sinks = []
+    try:
+        if args.output:
+            sinks.append(JsonlSink(args.output, manifest.outputs.get(args.output) if args.resume else None))
+            manifest.sinks.append(sinks[-1])
+        if args.parquet:
+            # a Parquet file can't be appended to, a resumed run writes a new one
+            parquet_path = args.parquet
+            if args.resume and os.path.exists(parquet_path):
+                parquet_path = time.strftime("%Y%m%d-%H%M%S-") + os.path.basename(parquet_path)
+                parquet_path = os.path.join(os.path.dirname(args.parquet), parquet_path)
+                print(f"Writing the Parquet records of the resumed run to {parquet_path}.")
+            sinks.append(ParquetSink(parquet_path))
+    except ImportError as ex:
+        print(f"ERROR. {ex}!")
+        for sink in sinks:
+            sink.close()
+        return
+
+    deduplicator = ChunkDeduplicator(args.near_duplicates) if args.dedup or args.near_duplicates > 0 else None
+
+    try:
+        if args.profile:
+            run_profiled(lambda: process_files(args, cache, name_prefilter, sinks, manifest, entity_index, deduplicator),
+                         args.profile, args.profiler)
+        else:
+            process_files(args, cache, name_prefilter, sinks, manifest, entity_index, deduplicator)
+    finally:
+        llm_client.close()
+        manifest.close()
+        if entity_index is not None:
+            entity_index.print_stats()
+        for sink in sinks:
+            sink.close()
+        if name_prefilter is not None:
+            name_prefilter.print_stats()
+        if deduplicator is not None:
+            deduplicator.print_stats()
+        if cache is not None:
+            cache.print_stats()
+            cache.close()
+
+    if uses_ner:
+        print_ner_timings()
+    if args.parsing_method == ParsingMethod.cascade:
+        print_cascade_stats()
+    if args.metrics:
+        metrics.print_summary()
+    if args.metrics_output:
+        metrics.save(args.metrics_output)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import time
+
+
+# global parameters
+MANIFEST_PATH = ".cache/manifest.json"
+FLUSH_INTERVAL = 2.0    # seconds, the manifest is rewritten at most this often
+INDEX_FLUSH_INTERVAL = 30.0     # seconds, the same with entity indices, which are saved by every flush
+INDEX_SAVE_SHARE = 0.05         # at most this part of the run time goes into saving the entity indices
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_hash(file_path):
+    """Hashes the content of the file, so a changed document isn't mistaken for a completed one."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+##----------------------------------------##
+
+def config_hash(config):
+    """Hashes the run configuration, so a resumed run never mixes results of different configurations."""
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+##----------------------------------------##
+
+def pages_to_ranges(pages):
+    """Compacts a set of page indices into a string such as "2-10,15"."""
+    ranges = []
+    for page_index in sorted(pages):
+        if ranges and ranges[-1][1] == page_index - 1:
+            ranges[-1][1] = page_index
+        else:
+            ranges.append([page_index, page_index])
+
+    return ",".join(f"{first}-{last}" if first != last else str(first) for first, last in ranges)
+
+##----------------------------------------##
+
+def ranges_to_pages(ranges):
+    pages = set()
+    for page_range in filter(None, ranges.split(",")):
+        first, _, last = page_range.partition("-")
+        pages.update(range(int(first), int(last or first) + 1))
+
+    return pages
+
+##----------------------------------------##
+
+class RunManifest:
+    """Records which pages of which documents are completed, keyed by the document name, its content hash and the run
+    configuration. It also records the size of the output files when the last page was completed, so that a resumed
+    run can drop the records of the pages that were not completed. The manifest is replaced atomically on every flush.
+    The entity indices registered in indices are saved by the same flush, right before the manifest, and get its
+    generation, so a resumed run can tell whether an index covers exactly the completed pages."""
+
+    def __init__(self, path, config, resume=False):
+        self.path = path
+        self.config = config_hash(config)
+        self.documents = {}     # document key -> completed page indices
+        self.outputs = {}       # output path -> size of the output when the last page was completed
+        self.keys = {}          # document path -> document key
+        self.sinks = []
+        self.indices = []       # (entity index, path), saved on every flush
+        self.generation = 0     # number of flushes of the run
+        self.flush_interval = FLUSH_INTERVAL
+        self.last_flush = 0.0
+        self.dirty = False
+
+        if resume and os.path.exists(path):
+            with open(path, "r") as f:
+                manifest = json.load(f)
+
+            if manifest.get("config") == self.config:
+                self.documents = {key: ranges_to_pages(pages) for key, pages in manifest["documents"].items()}
+                self.outputs = manifest.get("outputs", {})
+                self.generation = manifest.get("generation", 0)
+                print(f"Resuming the run, {sum(len(pages) for pages in self.documents.values())} pages are completed.")
+            else:
+                print("The run configuration has changed, starting the run from scratch.")
+
+    def document_key(self, file_path):
+        """The name and the content hash of the document, so two copies of a document are both processed."""
+        if file_path not in self.keys:
+            self.keys[file_path] = f"{os.path.basename(file_path)}:{file_hash(file_path)}"
+        return self.keys[file_path]
+
+    def completed_pages(self, file_path):
+        return self.documents.get(self.document_key(file_path), set())
+
+    def complete_page(self, file_path, page_index):
+        """Marks the page as completed. All its records have to be written to the sinks already, and none of the
+        next page, as the current size of the outputs is recorded as the point a resumed run truncates them to."""
+        self.documents.setdefault(self.document_key(file_path), set()).add(page_index)
+        for sink in self.sinks:
+            self.outputs[sink.path] = sink.tell()
+        self.dirty = True
+        self.flush()
+
+    def flush(self, force=False):
+        """Writes the manifest, at most once every FLUSH_INTERVAL seconds unless forced.
+        The outputs are flushed first, so the manifest never points past what is on disk. The offsets written are
+        the ones of the last completed page, not the current ones, which may include a part of an unfinished page.
+        With entity indices, which are rewritten whole, the interval is at least INDEX_FLUSH_INTERVAL and grows with
+        their save time, so saving them takes at most INDEX_SAVE_SHARE of the run time."""
+        if not self.dirty or (not force and time.monotonic() - self.last_flush < self.flush_interval):
+            return
+
+        for sink in self.sinks:
+            sink.flush()
+
+        self.generation += 1
+        start_time = time.perf_counter()
+        for index, index_path in self.indices:
+            index.generation = self.generation
+            index.save(index_path)
+        if self.indices:
+            self.flush_interval = max(INDEX_FLUSH_INTERVAL, (time.perf_counter() - start_time) / INDEX_SAVE_SHARE)
+
+        manifest = {
+            "config": self.config,
+            "generation": self.generation,
+            "documents": {key: pages_to_ranges(pages) for key, pages in self.documents.items()},
+            "outputs": self.outputs,
+        }
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+        self.last_flush = time.monotonic()
+        self.dirty = False
+
+    def close(self):
+        # the indices are written even when no page was completed
+        self.dirty = self.dirty or bool(self.indices)
+        self.flush(force=True)
@@ -0,0 +1,152 @@
+import cProfile
+import json
+import pstats
+import resource
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+
+
+# global parameters
+PERCENTILES = (0.5, 0.95, 0.99)
+NULL_STAGE = nullcontext()
+PROFILE_TOP_FUNCTIONS = 20
+
+
+def percentile(sorted_values, fraction):
+    """Nearest rank percentile of already sorted values."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+##----------------------------------------##
+
+def peak_rss_mb():
+    """Peak resident memory of this process, in MB (ru_maxrss is in KB on Linux and in bytes on macOS)."""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+
+##----------------------------------------##
+
+class Metrics:
+    """Per stage wall/CPU timers and run counters. When disabled, stage() returns a shared no-op context
+    and record()/count() return at once, so the instrumentation costs next to nothing."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.start_time = time.perf_counter()
+        self.wall = {}          # stage -> list of wall times, in seconds
+        self.cpu = {}           # stage -> total CPU time, in seconds
+        self.counters = {}
+
+    def enable(self):
+        self.enabled = True
+        self.reset()
+
+    def reset(self):
+        self.start_time = time.perf_counter()
+        self.wall = {}
+        self.cpu = {}
+        self.counters = {}
+
+    def stage(self, name, cpu=True):
+        """Times the block as a single run of the stage. The CPU time is the process time, so it isn't
+        meaningful for stages that overlap with other threads or tasks (pass cpu=False for these)."""
+        if not self.enabled:
+            return NULL_STAGE
+        return self._stage(name, cpu)
+
+    @contextmanager
+    def _stage(self, name, cpu):
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time() if cpu else None
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start_wall,
+                        time.process_time() - start_cpu if cpu else None)
+
+    def record(self, name, wall, cpu=None):
+        if not self.enabled:
+            return
+        self.wall.setdefault(name, []).append(wall)
+        if cpu is not None:
+            self.cpu[name] = self.cpu.get(name, 0.0) + cpu
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start_time
+        stages = {}
+        for name, values in self.wall.items():
+            values = sorted(values)
+            stages[name] = {
+                "count": len(values),
+                "wall": sum(values),
+                "cpu": self.cpu.get(name),
+                "mean": sum(values) / len(values),
+                **{f"p{int(fraction * 100)}": percentile(values, fraction) for fraction in PERCENTILES},
+            }
+
+        return {
+            "elapsed": elapsed,
+            "stages": stages,
+            "counters": dict(self.counters),
+            "throughput": {f"{name}_per_second": value / elapsed if elapsed else 0.0 for name, value in self.counters.items()},
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"{'stage':<16}{'count':>8}{'wall s':>10}{'cpu s':>10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name, stage in summary["stages"].items():
+            cpu = f"{stage['cpu']:.2f}" if stage["cpu"] is not None else "-"
+            print(f"{name:<16}{stage['count']:>8}{stage['wall']:>10.2f}{cpu:>10}{stage['mean'] * 1000:>10.1f}"
+                  f"{stage['p50'] * 1000:>10.1f}{stage['p95'] * 1000:>10.1f}{stage['p99'] * 1000:>10.1f}")
+
+        print(f"Elapsed: {summary['elapsed']:.2f} seconds, peak RSS: {summary['peak_rss_mb']:.1f} MB.")
+        for name, value in summary["throughput"].items():
+            print(f"{name.replace('_', ' ')}: {value:.2f}")
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+##----------------------------------------##
+
+def run_profiled(fn, path, profiler="cprofile"):
+    """Runs fn under a profiler and saves the profile to path: cProfile stats (see pstats or snakeviz),
+    or a pyinstrument HTML report."""
+    if profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("ERROR. pyinstrument is not installed, install it with 'pip install pyinstrument'!")
+            return fn()
+
+        instrument = Profiler()
+        instrument.start()
+        try:
+            return fn()
+        finally:
+            instrument.stop()
+            with open(path, "w") as f:
+                f.write(instrument.output_html())
+            print(f"Saved the pyinstrument report to {path}.")
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        return fn()
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
+        print(f"Saved the cProfile stats to {path}, the top functions by cumulative time:")
+        pstats.Stats(profile).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+
+
+# the metrics of the run, disabled unless asked for
+metrics = Metrics()
@@ -0,0 +1,111 @@
+import os
+import torch
+from gliner import GLiNER
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+
+# global parameters
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+ONNX_FOLDER_SUFFIX = "-onnx"
+ONNX_OPSET = 14
+BACKENDS = ["torch", "int8", "onnx", "onnx_int8"]
+
+threads_configured = False     # set once per process by configure_threads
+
+
+def configure_threads(intra_threads=0, inter_threads=0):
+    """Sets the intra-op (within an operator) and inter-op (between operators) CPU thread pools of torch.
+    0 keeps the default. The inter-op pool can only be set once, before any parallel work has started,
+    so only the first call of a process has an effect."""
+    global threads_configured
+    if threads_configured:
+        return
+    threads_configured = True
+
+    if intra_threads > 0:
+        torch.set_num_threads(intra_threads)
+    if inter_threads > 0:
+        torch.set_num_interop_threads(inter_threads)
+
+##----------------------------------------##
+
+def onnx_folder(checkpoint):
+    """The folder of the exported ONNX model of a checkpoint."""
+    return checkpoint.rstrip("/") + ONNX_FOLDER_SUFFIX
+
+##----------------------------------------##
+
+def load_model(checkpoint, backend="torch", local_files_only=False, intra_threads=0, inter_threads=0):
+    """Loads a GLiNER model for CPU inference with the given backend:
+    torch - the full precision PyTorch model,
+    int8 - the PyTorch model with its linear layers dynamically quantized to int8,
+    onnx / onnx_int8 - the model exported by export_onnx, run by ONNX Runtime.
+    The torch thread pools are set by configure_threads, once per process, before the first model is loaded."""
+    if backend in ("onnx", "onnx_int8"):
+        if ort is None:
+            raise ImportError("the ONNX backend requires onnxruntime, install it with 'pip install onnxruntime'")
+
+        session_options = ort.SessionOptions()
+        if intra_threads > 0:
+            session_options.intra_op_num_threads = intra_threads
+        if inter_threads > 0:
+            session_options.inter_op_num_threads = inter_threads
+
+        onnx_file = ONNX_QUANTIZED_MODEL_FILE if backend == "onnx_int8" else ONNX_MODEL_FILE
+        return GLiNER.from_pretrained(onnx_folder(checkpoint), load_onnx_model=True, load_tokenizer=True,
+                                      onnx_model_file=onnx_file, session_options=session_options, local_files_only=True)
+
+    if local_files_only:
+        model = GLiNER.from_pretrained(checkpoint, load_tokenizer=True, local_files_only=True)
+    else:
+        model = GLiNER.from_pretrained(checkpoint)
+
+    if backend == "int8":
+        torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    model.eval()
+
+    return model
+
+##----------------------------------------##
+
+def export_onnx(checkpoint, local_files_only=False, quantize=True):
+    """Exports the checkpoint to <checkpoint>-onnx/model.onnx (and model_quantized.onnx with dynamic int8 weights),
+    together with its config and tokenizer. Returns the folder of the exported model."""
+    model = load_model(checkpoint, "torch", local_files_only)
+    save_path = onnx_folder(checkpoint)
+    model.save_pretrained(save_path)
+
+    text = "John Smith and Emma Williams met in Madagascar."
+    labels = ["first_name", "last_name"]
+    inputs, _ = model.prepare_model_inputs([text], labels)
+
+    input_names = ["input_ids", "attention_mask", "words_mask", "text_lengths"]
+    dynamic_axes = {
+        "input_ids": {0: "batch_size", 1: "sequence_length"},
+        "attention_mask": {0: "batch_size", 1: "sequence_length"},
+        "words_mask": {0: "batch_size", 1: "sequence_length"},
+        "text_lengths": {0: "batch_size", 1: "value"},
+        "logits": {0: "position", 1: "batch_size", 2: "sequence_length", 3: "num_classes"},
+    }
+    if model.config.span_mode != "token_level":
+        input_names += ["span_idx", "span_mask"]
+        dynamic_axes["span_idx"] = {0: "batch_size", 1: "num_spans", 2: "idx"}
+        dynamic_axes["span_mask"] = {0: "batch_size", 1: "num_spans"}
+
+    onnx_path = os.path.join(save_path, ONNX_MODEL_FILE)
+    torch.onnx.export(model.model, tuple(inputs[name] for name in input_names), f=onnx_path,
+                      input_names=input_names, output_names=["logits"], dynamic_axes=dynamic_axes, opset_version=ONNX_OPSET)
+    print(f"Exported the ONNX model to {onnx_path}.")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantized_path = os.path.join(save_path, ONNX_QUANTIZED_MODEL_FILE)
+        quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QUInt8)
+        print(f"Exported the quantized ONNX model to {quantized_path}.")
+
+    return save_path
@@ -0,0 +1,338 @@
+import array
+import glob
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import torch
+from torch.utils.data import Dataset, Sampler
+
+
+# global parameters
+CACHE_FOLDER = ".cache"
+CACHE_VERSION = 2       # bumped when the layout of the cache changes, so old caches are rebuilt
+TOKENIZE_BATCH_SIZE = 1000
+BUCKET_SIZE = 50        # batches sorted by length together
+SEPARATOR = "\x1f"      # between the words of an example in tokens.bin
+ARRAYS = ["token_offsets", "spans", "span_offsets", "lengths"]
+SUBWORD_ARRAYS = ["subword_ids", "subword_offsets", "word_subwords", "word_offsets"]
+MAX_MODEL_LENGTH = 100000   # a larger model_max_length of a tokenizer means no limit
+
+
+def find_shards(paths):
+    """Expands the dataset paths (JSONL or JSON files, folders of them, glob patterns) into a sorted list of shards."""
+    shards = set()
+    for path in paths:
+        if os.path.isdir(path):
+            shards.update(os.path.join(path, name) for name in os.listdir(path) if name.endswith((".jsonl", ".json")))
+        else:
+            shards.update(glob.glob(path) or [path])
+
+    return sorted(shards)
+
+##----------------------------------------##
+
+def iter_examples(shards):
+    """Streams the examples of the shards. A JSONL shard is read line by line, a JSON shard (a list) at once."""
+    for shard in shards:
+        with open(shard, "r", encoding="utf-8") as f:
+            if shard.endswith(".jsonl"):
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+            else:
+                yield from json.load(f)
+
+##----------------------------------------##
+
+def tokenizer_fingerprint(tokenizer):
+    """Identifies the tokenizer by its class, name and vocabulary, so a changed tokenizer invalidates the cache."""
+    if tokenizer is None:
+        return "words"
+
+    vocab = json.dumps(sorted(tokenizer.get_vocab().items()))
+    return hashlib.sha256(f"{type(tokenizer).__name__}:{tokenizer.name_or_path}:{vocab}".encode("utf-8")).hexdigest()
+
+##----------------------------------------##
+
+def tokenize_words(tokenizer, batch):
+    """The subword ids of every word list of the batch and the number of them per word. The ids are only known with
+    a fast tokenizer (which maps the subwords back to the words), otherwise they are None and every word counts
+    as one subword without a tokenizer."""
+    if tokenizer is None:
+        return [(None, [1] * len(words)) for words in batch]
+
+    encoded = tokenizer(batch, is_split_into_words=True, add_special_tokens=False)
+    if not getattr(tokenizer, "is_fast", False):
+        # only the subword count of the whole example is known
+        return [(None, [len(input_ids)]) for input_ids in encoded["input_ids"]]
+
+    tokenized = []
+    for index, words in enumerate(batch):
+        word_subwords = [0] * len(words)
+        for word_index in encoded.word_ids(index):
+            if word_index is not None:
+                word_subwords[word_index] += 1
+        tokenized.append((encoded["input_ids"][index], word_subwords))
+
+    return tokenized
+
+##----------------------------------------##
+
+def build_cache(shards, tokenizer, folder):
+    """Converts the examples of the shards, in a single streaming pass, into memory mapped arrays:
+    tokens.bin - the UTF-8 words of all the examples, separated by SEPARATOR,
+    token_offsets.npy - where the words of every example start in tokens.bin (plus the end of the last one),
+    spans.npy - the (start, end, label id) spans of all the examples, span_offsets.npy - the same for the spans,
+    lengths.npy - the number of subword tokens of every example, for the length bucketing,
+    subword_ids.npy, subword_offsets.npy - the subword ids of all the examples (with a fast tokenizer),
+    word_subwords.npy, word_offsets.npy - the number of subword ids of every word of all the examples,
+    meta.json - the labels, the number of examples and the tokenizer fingerprint.
+    The cache is written into a temporary folder first, so an interrupted build leaves nothing behind."""
+    temp_folder = folder + ".tmp"
+    shutil.rmtree(temp_folder, ignore_errors=True)
+    os.makedirs(temp_folder)
+
+    token_offsets = array.array("q", [0])
+    spans = array.array("q")
+    span_offsets = array.array("q", [0])
+    lengths = array.array("q")
+    subwords = {"subword_ids": array.array("q"), "subword_offsets": array.array("q", [0]),
+                "word_subwords": array.array("q"), "word_offsets": array.array("q", [0])}
+    has_subword_ids = True
+    labels = {}
+    batch = []
+
+    def add_batch(batch):
+        nonlocal has_subword_ids
+        for subword_ids, word_subwords in tokenize_words(tokenizer, batch):
+            lengths.append(sum(word_subwords))
+            has_subword_ids = has_subword_ids and subword_ids is not None
+            if has_subword_ids:
+                subwords["subword_ids"].extend(subword_ids)
+                subwords["subword_offsets"].append(len(subwords["subword_ids"]))
+                subwords["word_subwords"].extend(word_subwords)
+                subwords["word_offsets"].append(len(subwords["word_subwords"]))
+    with open(os.path.join(temp_folder, "tokens.bin"), "wb") as f:
+        for example in iter_examples(shards):
+            data = SEPARATOR.join(example["tokenized_text"]).encode("utf-8")
+            f.write(data)
+            token_offsets.append(token_offsets[-1] + len(data))
+
+            for start, end, label in example["ner"]:
+                spans.extend((start, end, labels.setdefault(label, len(labels))))
+            span_offsets.append(len(spans) // 3)
+
+            batch.append(example["tokenized_text"])
+            if len(batch) == TOKENIZE_BATCH_SIZE:
+                add_batch(batch)
+                batch = []
+
+    if batch:
+        add_batch(batch)
+
+    arrays = [("token_offsets", token_offsets), ("spans", spans), ("span_offsets", span_offsets), ("lengths", lengths)]
+    if has_subword_ids:
+        arrays += list(subwords.items())
+    for name, values in arrays:
+        values = np.frombuffer(values, dtype=np.int64) if len(values) else np.zeros(0, dtype=np.int64)
+        np.save(os.path.join(temp_folder, name + ".npy"), values.reshape(-1, 3) if name == "spans" else values)
+
+    with open(os.path.join(temp_folder, "meta.json"), "w") as f:
+        json.dump({"examples": len(lengths), "labels": list(labels), "shards": shards,
+                   "tokenizer": tokenizer_fingerprint(tokenizer), "subword_ids": has_subword_ids}, f)
+
+    os.replace(temp_folder, folder)
+
+##----------------------------------------##
+
+class CachedDataset(Dataset):
+    """Map style dataset of the examples of a dataset cache (or of a subset of them, by indices).
+    The arrays are memory mapped on first access, so every data loader worker maps them itself
+    instead of receiving a pickled copy, and only the pages in use are kept in RAM.
+    With cached subword ids, the examples have them too, for CachedTokenCollator."""
+
+    def __init__(self, folder, indices=None):
+        self.folder = folder
+        with open(os.path.join(folder, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+
+        self.indices = np.arange(self.meta["examples"]) if indices is None else indices
+        self.arrays = None
+
+    def open(self):
+        names = ARRAYS + (SUBWORD_ARRAYS if self.meta.get("subword_ids") else [])
+        self.arrays = {name: np.load(os.path.join(self.folder, name + ".npy"), mmap_mode="r") for name in names}
+        tokens_path = os.path.join(self.folder, "tokens.bin")
+        # an empty file can't be memory mapped
+        self.arrays["tokens"] = np.memmap(tokens_path, dtype=np.uint8, mode="r") if os.path.getsize(tokens_path) else b""
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["arrays"] = None
+        return state
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if self.arrays is None:
+            self.open()
+
+        example_index = int(self.indices[index])
+        token_offsets = self.arrays["token_offsets"]
+        start, end = int(token_offsets[example_index]), int(token_offsets[example_index + 1])
+        words = bytes(self.arrays["tokens"][start:end]).decode("utf-8").split(SEPARATOR) if end > start else []
+
+        span_offsets = self.arrays["span_offsets"]
+        spans = self.arrays["spans"][int(span_offsets[example_index]):int(span_offsets[example_index + 1])]
+        labels = self.meta["labels"]
+
+        example = {"tokenized_text": words, "ner": [[int(start), int(end), labels[int(label)]] for start, end, label in spans]}
+        if self.meta.get("subword_ids"):
+            subword_offsets, word_offsets = self.arrays["subword_offsets"], self.arrays["word_offsets"]
+            example["subword_ids"] = np.asarray(self.arrays["subword_ids"][int(subword_offsets[example_index]):int(subword_offsets[example_index + 1])])
+            example["word_subwords"] = np.asarray(self.arrays["word_subwords"][int(word_offsets[example_index]):int(word_offsets[example_index + 1])])
+        return example
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def lengths(self):
+        """The number of subword tokens of every example."""
+        if self.arrays is None:
+            self.open()
+        return np.asarray(self.arrays["lengths"][self.indices])
+
+    def split(self, ratio, seed):
+        """Splits the examples randomly (but reproducibly, by the seed) into two subsets, the first with ratio of them."""
+        indices = self.indices[np.random.default_rng(seed).permutation(len(self.indices))]
+        size = int(len(indices) * ratio)
+        return CachedDataset(self.folder, indices[:size]), CachedDataset(self.folder, indices[size:])
+
+##----------------------------------------##
+
+def load_cached_dataset(paths, tokenizer=None, cache_folder=CACHE_FOLDER):
+    """Returns the cached dataset of the shards, building its cache on first use. The cache is reused across
+    epochs and runs, a new one is built when a shard or the tokenizer changes."""
+    shards = find_shards(paths)
+    sources = [(os.path.abspath(shard), os.path.getsize(shard), os.path.getmtime(shard)) for shard in shards]
+    key = hashlib.sha256(json.dumps([sources, tokenizer_fingerprint(tokenizer), CACHE_VERSION]).encode("utf-8")).hexdigest()[:16]
+    folder = os.path.join(cache_folder, key)
+
+    if os.path.exists(os.path.join(folder, "meta.json")):
+        print(f"Using the dataset cache {folder}.")
+    else:
+        print(f"Caching {len(shards)} shards in {folder}.")
+        os.makedirs(cache_folder, exist_ok=True)
+        build_cache(shards, tokenizer, folder)
+
+    return CachedDataset(folder)
+
+##----------------------------------------##
+
+class LengthBucketSampler(Sampler):
+    """Shuffles the examples, sorts every BUCKET_SIZE batches worth of them by length and cuts them into batches,
+    then shuffles the batches. The batches hold examples of similar lengths, so there is little padding.
+    The only incomplete batch comes last, so the batches stay aligned when the data loader regroups the indices."""
+
+    def __init__(self, lengths, batch_size, seed=0, bucket_size=BUCKET_SIZE):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.seed = seed
+        self.bucket_size = bucket_size
+        self.epoch = 0
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed + self.epoch)
+        self.epoch += 1
+
+        indices = rng.permutation(len(self.lengths))
+        bucket = self.batch_size * self.bucket_size
+        batches = []
+        for start in range(0, len(indices), bucket):
+            bucket_indices = indices[start:start + bucket]
+            bucket_indices = bucket_indices[np.argsort(-self.lengths[bucket_indices], kind="stable")]
+            batches += [bucket_indices[i:i + self.batch_size] for i in range(0, len(bucket_indices), self.batch_size)]
+
+        incomplete = [batch for batch in batches if len(batch) < self.batch_size]
+        batches = [batch for batch in batches if len(batch) == self.batch_size]
+        for batch_index in rng.permutation(len(batches)):
+            yield from batches[batch_index].tolist()
+        for batch in incomplete:
+            yield from batch.tolist()
+
+##----------------------------------------##
+
+class CachedTokenCollator:
+    """Wraps the data collator of a GLiNER model, so the words of the examples aren't tokenized again in every
+    epoch: the tokenization of the data processor is replaced by their cached subword ids, with the ids of the
+    label prompt of the batch (tokenized once per distinct prompt) in front and the special tokens around them.
+    Batches with examples without cached ids, and bi-encoder models (whose labels aren't in the prompt), are
+    tokenized by the data processor as before."""
+
+    def __init__(self, collator, data_processor):
+        self.collator = collator
+        self.processor = data_processor
+        self.tokenizer = data_processor.transformer_tokenizer
+        self.prompt_ids = {}
+        self.batch = None
+
+        marked = self.tokenizer.build_inputs_with_special_tokens([-1])
+        self.leading_specials = marked.index(-1)
+        self.specials = len(marked) - 1
+        self.max_length = self.tokenizer.model_max_length if self.tokenizer.model_max_length < MAX_MODEL_LENGTH else None
+
+        self.tokenize_inputs = data_processor.tokenize_inputs
+        if hasattr(data_processor, "prepare_inputs") and getattr(data_processor.config, "labels_encoder", None) is None:
+            data_processor.tokenize_inputs = self.tokenize_cached
+
+    def __call__(self, examples):
+        self.batch = examples if all("subword_ids" in example for example in examples) else None
+        try:
+            return self.collator(examples)
+        finally:
+            self.batch = None
+
+    def tokenize_cached(self, texts, entities):
+        """Stands in for the tokenize_inputs of the data processor: the input ids, the attention mask and the words
+        mask (the 1 based index of the word on its first subword, 0 elsewhere) of the prompt and the words."""
+        cached = self.batch is not None and len(self.batch) == len(texts) and all(
+            len(words) == len(example["word_subwords"]) for words, example in zip(texts, self.batch))
+        if not cached:
+            return self.tokenize_inputs(texts, entities)
+
+        prompts, _ = self.processor.prepare_inputs([[] for _ in texts], entities)
+        all_input_ids = []
+        words_masks = []
+        for prompt, example in zip(prompts, self.batch):
+            if tuple(prompt) not in self.prompt_ids:
+                self.prompt_ids[tuple(prompt)] = self.tokenizer(prompt, is_split_into_words=True, add_special_tokens=False)["input_ids"]
+            prompt_ids = self.prompt_ids[tuple(prompt)]
+
+            input_ids = list(prompt_ids) + example["subword_ids"].tolist()
+            words_mask = [0] * len(prompt_ids)
+            for word, subwords in enumerate(example["word_subwords"].tolist(), start=1):
+                words_mask += [word] + [0] * (subwords - 1) if subwords else []
+            if self.max_length is not None:
+                input_ids = input_ids[:self.max_length - self.specials]
+                words_mask = words_mask[:len(input_ids)]
+
+            input_ids = self.tokenizer.build_inputs_with_special_tokens(input_ids)
+            words_mask = [0] * self.leading_specials + words_mask
+            all_input_ids.append(input_ids)
+            words_masks.append(words_mask + [0] * (len(input_ids) - len(words_mask)))
+
+        length = max(len(input_ids) for input_ids in all_input_ids)
+        return {
+            "input_ids": torch.tensor([input_ids + [self.tokenizer.pad_token_id] * (length - len(input_ids)) for input_ids in all_input_ids]),
+            "attention_mask": torch.tensor([[1] * len(input_ids) + [0] * (length - len(input_ids)) for input_ids in all_input_ids]),
+            "words_mask": torch.tensor([words_mask + [0] * (length - len(words_mask)) for words_mask in words_masks]),
+        }
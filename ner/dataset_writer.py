@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import zlib
+
+
+# global parameters
+FLUSH_EVERY = 1000      # examples written between two flushes
+FLUSH_INTERVAL = 5.0    # seconds between two flushes
+WRITE_BUFFER_SIZE = 1024 * 1024     # bytes
+NON_LETTERS_PATTERN = re.compile(r"[\W\d_]+")
+SHINGLE_SIZE = 3        # words per shingle
+LSH_BANDS = 8           # MinHash signature bands, a text sharing a band with a kept one is a near duplicate,
+LSH_ROWS = 8            # texts with a word shingle similarity of 0.9 share one 99% of the time, of 0.5 only 3%
+MINHASH_SEED = 17
+MERSENNE_PRIME = (1 << 61) - 1
+
+_rand = random.Random(MINHASH_SEED)
+PERMUTATIONS = [(_rand.randrange(1, MERSENNE_PRIME), _rand.randrange(0, MERSENNE_PRIME)) for _ in range(LSH_BANDS * LSH_ROWS)]
+
+
+def normalize_text(text):
+    """Lowercases the text and collapses everything but letters into single spaces, so texts that differ only in
+    case, punctuation, digits or whitespace are the same."""
+    return NON_LETTERS_PATTERN.sub(" ", text.lower()).strip()
+
+##----------------------------------------##
+
+def band_digests(text):
+    """The 8 byte digests of the LSH bands of the MinHash signature of the word shingles of the normalized text."""
+    words = text.split()
+    shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+    hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in shingles]
+    signature = [min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in PERMUTATIONS]
+    return [hashlib.blake2b(f"{band}:{signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]}".encode("utf-8"), digest_size=8).digest()
+            for band in range(LSH_BANDS)]
+
+##----------------------------------------##
+
+class DatasetWriter:
+    """Writes the examples into a JSONL file as they come, one compact example per line. The file is flushed to
+    disk every FLUSH_EVERY examples or FLUSH_INTERVAL seconds, so a crash loses only the last few examples."""
+
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.path = path
+        self.file = open(path, "w", encoding="utf-8", buffering=WRITE_BUFFER_SIZE)
+        self.written = 0
+        self.last_flush = time.monotonic()
+
+    def write(self, example):
+        self.file.write(json.dumps(example, ensure_ascii=False, separators=(",", ":")))
+        self.file.write("\n")
+        self.written += 1
+
+        if self.written % FLUSH_EVERY == 0 or time.monotonic() - self.last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+##----------------------------------------##
+
+class DatasetValidator:
+    """Streaming validation and dedup of the generated examples. Drops the malformed LLM outputs, the examples
+    without any span and the duplicates, and counts each of them. The duplicates are the texts that are the same
+    once normalized, and the near duplicates (e.g. reworded passages) found by MinHash LSH over word shingles.
+    Only 8 byte digests of every kept text (of the text and of its LSH bands) are held in memory."""
+
+    def __init__(self):
+        self.seen = set()
+        self.bands = set()
+        self.counts = {"outputs": 0, "malformed": 0, "no_spans": 0, "duplicates": 0, "near_duplicates": 0, "valid": 0}
+
+    def parse(self, output):
+        """Returns the JSON object of the LLM output, or None if it isn't an object with a text."""
+        self.counts["outputs"] += 1
+        try:
+            js = json.loads(output.strip())
+        except (AttributeError, ValueError) as ex:
+            print(f"Exception (while parsing the output): {ex}!")
+            js = None
+
+        if not isinstance(js, dict) or not isinstance(js.get("text"), str) or not js["text"].strip():
+            self.counts["malformed"] += 1
+            return None
+        return js
+
+    def check(self, example):
+        """Whether the example should be kept."""
+        if not example["ner"]:
+            self.counts["no_spans"] += 1
+            return False
+
+        text = normalize_text(" ".join(example["tokenized_text"]))
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+        if digest in self.seen:
+            self.counts["duplicates"] += 1
+            return False
+
+        bands = band_digests(text)
+        if any(band in self.bands for band in bands):
+            self.counts["near_duplicates"] += 1
+            return False
+
+        self.seen.add(digest)
+        self.bands.update(bands)
+        self.counts["valid"] += 1
+        return True
+
+    def print_stats(self):
+        print(f"Outputs: {self.counts['outputs']}, valid: {self.counts['valid']}, malformed: {self.counts['malformed']}, "
+              f"without spans: {self.counts['no_spans']}, duplicates: {self.counts['duplicates']}, "
+              f"near duplicates: {self.counts['near_duplicates']}.")
@@ -0,0 +1,80 @@
+import argparse
+import time
+from backends import BACKENDS, configure_threads, load_model
+from fine_tune import load_dataset
+
+
+# global parameters
+CHECKPOINT = "models/checkpoint-510"
+THRESHOLD = 0.5
+MAX_RECALL_DROP = 0.01  # recall drop (compared to the torch backend) that counts as an accuracy loss
+
+
+def gold_entities(example):
+    """The (text, label) pairs of the annotated spans of an example."""
+    tokens = example["tokenized_text"]
+    return {(" ".join(tokens[start:end + 1]).lower(), label) for start, end, label in example["ner"]}
+
+##----------------------------------------##
+
+def evaluate(model, examples, labels, batch_size):
+    """Measures the micro precision, recall and F1 on the examples, and the throughput of the model."""
+    true_positives = 0
+    predicted = 0
+    expected = 0
+
+    start_time = time.perf_counter()
+    for start in range(0, len(examples), batch_size):
+        batch = examples[start:start + batch_size]
+        texts = [" ".join(example["tokenized_text"]) for example in batch]
+        batch_entities = model.batch_predict_entities(texts, labels, threshold=THRESHOLD)
+
+        for example, entities in zip(batch, batch_entities):
+            gold = gold_entities(example)
+            prediction = {(ent["text"].lower(), ent["label"]) for ent in entities}
+            true_positives += len(gold & prediction)
+            predicted += len(prediction)
+            expected += len(gold)
+    elapsed = time.perf_counter() - start_time
+
+    precision = true_positives / predicted if predicted else 0.0
+    recall = true_positives / expected if expected else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1, "examples_per_second": len(examples) / elapsed if elapsed else 0.0}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--checkpoint', default=CHECKPOINT, help='checkpoint (path or hub name) to evaluate')
+    parser.add_argument('-b', '--backends', nargs='*', default=BACKENDS, choices=BACKENDS, help='backends to compare')
+    parser.add_argument('-bs', '--batch_size', default=8, type=int, help='number of examples in a single batch')
+    parser.add_argument('--intra_threads', default=0, type=int, help='intra-op CPU threads (0 - default)')
+    parser.add_argument('--inter_threads', default=0, type=int, help='inter-op CPU threads (0 - default)')
+    args = parser.parse_args()
+
+    print("--Handle Dataset--")
+    _, test_dataset = load_dataset()
+    labels = sorted({label for example in test_dataset for _, _, label in example["ner"]})
+    print(f"Evaluating on the {len(test_dataset)} held-out examples, labels: {labels}")
+
+    # the torch thread pools can be set only once per process, before any of the backends runs
+    configure_threads(args.intra_threads, args.inter_threads)
+
+    results = {}
+    for backend in args.backends:
+        print(f"--Evaluate the {backend} backend--")
+        try:
+            model = load_model(args.checkpoint, backend, not args.checkpoint.startswith("urchade/"), args.intra_threads, args.inter_threads)
+        except (ImportError, OSError, ValueError) as ex:
+            print(f"Exception (while loading the {backend} backend): {ex}!")
+            continue
+        results[backend] = evaluate(model, test_dataset, labels, args.batch_size)
+
+    print(f"{'backend':<12}{'precision':>10}{'recall':>10}{'f1':>10}{'examples/s':>12}{'speedup':>10}")
+    reference = results.get("torch")
+    for backend, result in results.items():
+        speedup = result["examples_per_second"] / reference["examples_per_second"] if reference and reference["examples_per_second"] else 0.0
+        print(f"{backend:<12}{result['precision']:>10.3f}{result['recall']:>10.3f}{result['f1']:>10.3f}"
+              f"{result['examples_per_second']:>12.2f}{speedup:>10.2f}")
+        if reference and result["recall"] < reference["recall"] - MAX_RECALL_DROP:
+            print(f"WARNING. the recall of the {backend} backend dropped by {reference['recall'] - result['recall']:.3f}!")
@@ -0,0 +1,17 @@
+import argparse
+from backends import export_onnx
+
+
+# global parameters
+CHECKPOINT = "models/checkpoint-510"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--checkpoint', default=CHECKPOINT, help='checkpoint (path or hub name) to export')
+    parser.add_argument('--no_quantize', action='store_true', help='do not write the dynamically quantized (int8) ONNX model')
+    args = parser.parse_args()
+
+    print(f"--Export the {args.checkpoint} model--")
+    save_path = export_onnx(args.checkpoint, local_files_only=not args.checkpoint.startswith("urchade/"), quantize=not args.no_quantize)
+    print(f"Done, run main.py with '-nb onnx' or '-nb onnx_int8' to use {save_path}.")
@@ -1,37 +1,67 @@
-import json
+import argparse
 import os
-import random
 import torch
 from gliner import GLiNER
 from gliner.training import Trainer, TrainingArguments
 from gliner.data_processing.collator import DataCollator
+from dataset_loader import CACHE_FOLDER, CachedTokenCollator, LengthBucketSampler, load_cached_dataset
 
 
 # global parameters
 INPUT_FOLDER = "data"
 INPUT_FILE_NAME = "20240925-215236.json"
 MODEL = "urchade/gliner_medium-v2.1"
+SPLIT_SEED = 17     # fixed, so the held-out split can be reproduced for evaluation
+TRAIN_RATIO = 0.9
+NUM_STEPS = 500
+BATCH_SIZE = 2
+NUM_WORKERS = 4     # data loader worker processes
+
+
+def load_dataset(data_paths=None, tokenizer=None):
+    """Reads the dataset (JSONL or JSON shards) through its memory mapped cache and splits it into the training
+    and the held-out (testing) parts. Both are memory mapped, the examples are only read when they are used."""
+    dir_name = os.path.dirname(os.path.realpath(__file__))
+    if not data_paths:
+        data_paths = [dir_name + "/" + INPUT_FOLDER + "/" + INPUT_FILE_NAME]
+
+    print(f"Reading the {', '.join(data_paths)} dataset.")
+    data = load_cached_dataset(data_paths, tokenizer, dir_name + "/" + CACHE_FOLDER)
+    print('Dataset size:', len(data))
 
-os.environ["TOKENIZERS_PARALLELISM"] = "true"
+    train_dataset, test_dataset = data.split(TRAIN_RATIO, SPLIT_SEED)
+    print('Dataset is shuffled...')
 
+    return train_dataset, test_dataset
 
-if __name__ == "__main__":
-    print("--Handle Dataset--")
-    full_path = os.path.realpath(__file__)
-    dir_name = os.path.dirname(full_path)
-    data_path = dir_name + "/" + INPUT_FOLDER + "/" + INPUT_FILE_NAME
+##----------------------------------------##
 
-    print(f"Reading the {data_path} dataset.")
-    with open(data_path, "r") as f:
-        data = json.load(f)
+class BucketedTrainer(Trainer):
+    """Trainer whose training batches hold examples of similar lengths, to cut the padding."""
 
-    print('Dataset size:', len(data))
+    def _get_train_sampler(self, *args, **kwargs):
+        return LengthBucketSampler(self.train_dataset.lengths(), self.args.per_device_train_batch_size, self.args.seed)
 
-    random.shuffle(data)
-    print('Dataset is shuffled...')
 
-    train_dataset = data[:int(len(data)*0.9)]
-    test_dataset = data[int(len(data)*0.9):]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--data', nargs='*', default=None, help='JSONL or JSON dataset shards, folders of them or glob patterns (defaults to INPUT_FILE_NAME)')
+    parser.add_argument('-bs', '--batch_size', default=BATCH_SIZE, type=int, help='training batch size')
+    parser.add_argument('--num_steps', default=NUM_STEPS, type=int, help='approximate number of training steps')
+    parser.add_argument('-w', '--workers', default=NUM_WORKERS, type=int, help='number of data loader worker processes')
+    parser.add_argument('--no_bucketing', action='store_true', help='batch random examples instead of examples of similar lengths')
+    args = parser.parse_args()
+
+    # the cache build uses the thread pool of the tokenizer before the data loader workers are forked,
+    # which then tokenize in the collator, so its parallelism has to be off to avoid a deadlock in them
+    os.environ["TOKENIZERS_PARALLELISM"] = "false" if args.workers > 0 else "true"
+
+    print(f"Loading the {MODEL} model.")
+    model = GLiNER.from_pretrained(MODEL)
+
+    print("--Handle Dataset--")
+    # the lengths of the cache are counted by the tokenizer of the model, a different tokenizer gets a new cache
+    train_dataset, test_dataset = load_dataset(args.data, model.data_processor.transformer_tokenizer)
 
     print('Dataset is splitted...')
     print('Training dataset size:', len(train_dataset))
@@ -41,13 +71,14 @@ if __name__ == "__main__":
     device = torch.device('cuda:0') if torch.cuda.is_available() else torch.device('cpu')
 
     print(f"Using {device}...")
-    model = GLiNER.from_pretrained(MODEL)
     model.to(device)
 
-    data_collator = DataCollator(model.config, data_processor=model.data_processor, prepare_labels=True)
+    # the words of the examples are tokenized once, by the cache build, and not again in every epoch
+    data_collator = CachedTokenCollator(DataCollator(model.config, data_processor=model.data_processor, prepare_labels=True),
+                                        model.data_processor)
 
-    num_steps = 500
-    batch_size = 2
+    num_steps = args.num_steps
+    batch_size = args.batch_size
     data_size = len(train_dataset)
     num_batches = data_size // batch_size
     num_epochs = max(1, num_steps // num_batches)
@@ -68,12 +99,13 @@ if __name__ == "__main__":
         evaluation_strategy="steps",
         save_steps=100,
         save_total_limit=10,
-        dataloader_num_workers=0,
+        dataloader_num_workers=args.workers,
+        dataloader_persistent_workers=args.workers > 0,
         use_cpu=False,
         report_to="none",
         )
 
-    trainer = Trainer(
+    trainer = (Trainer if args.no_bucketing else BucketedTrainer)(
         model=model,
         args=training_args,
         train_dataset=train_dataset,
@@ -1,27 +1,23 @@
-import json
+import argparse
 import os
 import re
 import random
 import time
-from vllm import LLM, SamplingParams
 from constants import *
+from dataset_writer import DatasetValidator, DatasetWriter
+from llm_backends import BACKENDS, OLLAMA_CONCURRENCY, make_backend
 
 
 # global parameters
 OUTPUT_FOLDER = "data"
-OUTPUT_FILE_EXTENSION = ".json"
+OUTPUT_FILE_EXTENSION = ".jsonl"
 NUM_SAMPLES = 10
 LLM_MODEL = "neuralmagic/Mistral-7B-Instruct-v0.3-GPTQ-4bit"
 NUM_GPUs = 1
+SEED = 17
+CHUNK_SIZE = 4096       # prompts submitted to the backend in a single call
 
 
-def save_data_to_file(data, full_file_path):
-    """Saves the processed data to a file in a JSON format."""
-    with open(full_file_path, 'w') as f:
-        json.dump(data, f)
-
-##----------------------------------------##
-
 def create_prompt_for_synthetic_data_generation(**kwargs):
     """Creates a prompt that the input parameters. This prompt will be used to generate the synthetic data."""
     # Building the initial part of the prompt
@@ -75,6 +71,16 @@ def tokenize_text(text):
 
 ##----------------------------------------##
 
+def index_tokens(tokens):
+    """Maps every (lowercase) token to its positions in the tokens."""
+    token_index = {}
+    for position, token in enumerate(tokens):
+        token_index.setdefault(token, []).append(position)
+
+    return token_index
+
+##----------------------------------------##
+
 def extract_entities(data, entities):
     all_examples = []
 
@@ -82,6 +88,8 @@ def extract_entities(data, entities):
         # Attempt to extract entities; skip current record on failure
         try:
             tokens = tokenize_text(dt['text'])
+            lower_tokens = [token.lower() for token in tokens]
+            token_index = index_tokens(lower_tokens)
             # FIX. LLM's outputs are not consistent, overriding the categories manually
             # entities = [(k["entity"], k["types"]) for k in dt['entities']]
             all_entities = entities
@@ -100,11 +108,14 @@ def extract_entities(data, entities):
                 elif category.lower() == "surname":
                     categories.append("last_name")
 
-            entity_tokens = tokenize_text(str(entity[0]))
+            entity_tokens = [token.lower() for token in tokenize_text(str(entity[0]))]
+            if not entity_tokens:
+                continue
 
-            # Find the start and end indices of each entity in the tokenized text
-            for i in range(len(tokens) - len(entity_tokens) + 1):
-                if " ".join(tokens[i:i + len(entity_tokens)]).lower() == " ".join(entity_tokens).lower():
+            # Find the start and end indices of each entity in the tokenized text,
+            # only at the positions of its first token
+            for i in token_index.get(entity_tokens[0], []):
+                if lower_tokens[i:i + len(entity_tokens)] == entity_tokens:
                     for category in categories:
                         spans.append((i, i + len(entity_tokens) - 1, category.lower()))
 
@@ -115,54 +126,91 @@ def extract_entities(data, entities):
 
 ##----------------------------------------##
 
-def generate_from_prompt(prompt, llm, sampling_params, entities):
-    outputs = llm.generate(prompt, sampling_params)
-    # print(f"> total outputs:\n {outputs}")
+def make_jobs(num_samples, seed=SEED):
+    """Yields a (prompt, entities, seed) job for every text type and sample. All the choices come from a single
+    random generator seeded with the master seed, so the same seed gives the same jobs (and, with the per job seeds,
+    the same outputs)."""
+    rand = random.Random(seed)
+    for text_type in TEXT_TYPES:
+        for _ in range(num_samples):
+            name = rand.choice(FIRST_NAMES)
+            surname = rand.choice(SECOND_NAMES)
 
-    all_outs = []
-    for output in outputs:
-        try:
-            # print(f"-> raw output:\n {output.outputs[0].text.strip()}")
-            js = json.loads(output.outputs[0].text.strip())
-        except Exception as ex:
-            print(f"Exception (while generating from prompt): {ex}!")
-            continue
+            prompt = create_prompt_for_synthetic_data_generation(language="english",
+                                                                types_of_text = text_type,
+                                                                name=name,
+                                                                surname=surname)
 
-        # print(f"--> output as JSON:\n {js})")
-        all_outs.append(js)
+            entities = [(name, ["name"]),(surname, ["surname"])]
+            yield prompt, entities, rand.getrandbits(31)
 
-    return all_outs, extract_entities(all_outs, entities)
+##----------------------------------------##
 
+def make_chunks(jobs, chunk_size):
+    """Groups the jobs into lists of chunk_size jobs, so only a chunk of prompts is kept in memory."""
+    chunk = []
+    for job in jobs:
+        chunk.append(job)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
 
-if __name__ == "__main__":
-    llm = LLM(model=LLM_MODEL, gpu_memory_utilization=0.8, max_model_len=1500, tensor_parallel_size=NUM_GPUs, seed=17, quantization="GPTQ")
+    if chunk:
+        yield chunk
 
-    sampling_params = SamplingParams(top_k=100, max_tokens=1000, top_p=0.8, temperature=0.6, stop="<end>")
+##----------------------------------------##
 
-    all_outputs = []
-    for text_type in TEXT_TYPES:
-        for j in range(NUM_SAMPLES):
-            random.seed(time.process_time())
-            name = random.choice(FIRST_NAMES)
-            surname = random.choice(SECOND_NAMES)
+def generate_from_prompts(jobs, backend, validator):
+    """Sends the prompts of all the jobs to the backend in a single call. Yields the valid examples of the outputs."""
+    outputs = backend.generate([prompt for prompt, _, _ in jobs], [seed for _, _, seed in jobs])
 
-            prompt = create_prompt_for_synthetic_data_generation(language="english",
-                                                                types_of_text = text_type,
-                                                                name=name,
-                                                                surname=surname)
+    for output, (_, entities, _) in zip(outputs, jobs):
+        if output is None:
+            continue
 
-            entities = [(name, ["name"]),(surname, ["surname"])]
-            output, processed_output = generate_from_prompt(prompt, llm, sampling_params, entities)
-            # all_outputs.append(processed_output)
-            all_outputs += processed_output
+        js = validator.parse(output)
+        if js is None:
+            continue
+
+        for example in extract_entities([js], entities):
+            if validator.check(example):
+                yield example
 
-            print(f"Final response: {output}")
-            print(f"Processed output {processed_output}")
 
-    print(all_outputs)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--backend', default='vllm', choices=BACKENDS, help='LLM serving the prompts (fake - a deterministic stand-in for testing)')
+    parser.add_argument('-m', '--model', default=LLM_MODEL, help='LLM model name')
+    parser.add_argument('-n', '--num_samples', default=NUM_SAMPLES, type=int, help='number of samples per text type')
+    parser.add_argument('--seed', default=SEED, type=int, help='master seed of the generated prompts')
+    parser.add_argument('--chunk_size', default=CHUNK_SIZE, type=int, help='number of prompts submitted to the backend in a single call')
+    parser.add_argument('--num_gpus', default=NUM_GPUs, type=int, help='number of GPUs used by vllm')
+    parser.add_argument('--ollama_host', default=None, help='Ollama server address (defaults to OLLAMA_HOST or the local server)')
+    parser.add_argument('-c', '--concurrency', default=OLLAMA_CONCURRENCY, type=int, help='maximal number of Ollama requests in flight')
+    args = parser.parse_args()
+
+    backend = make_backend(args.backend, args.model, args.num_gpus, args.seed, args.ollama_host, args.concurrency)
+
     full_path = os.path.realpath(__file__)
     dir_name = os.path.dirname(full_path)
     file_name = time.strftime("%Y%m%d-%H%M%S")
-    save_data_to_file(all_outputs, dir_name + "/" + OUTPUT_FOLDER + "/" + file_name + OUTPUT_FILE_EXTENSION)
-
-    print("Done")
+    writer = DatasetWriter(dir_name + "/" + OUTPUT_FOLDER + "/" + file_name + OUTPUT_FILE_EXTENSION)
+    validator = DatasetValidator()
+
+    total_jobs = len(TEXT_TYPES) * args.num_samples
+    done_jobs = 0
+    start_time = time.perf_counter()
+    try:
+        for jobs in make_chunks(make_jobs(args.num_samples, args.seed), args.chunk_size):
+            for example in generate_from_prompts(jobs, backend, validator):
+                writer.write(example)
+
+            done_jobs += len(jobs)
+            elapsed = time.perf_counter() - start_time
+            print(f"Generated {done_jobs}/{total_jobs} samples ({writer.written} examples), "
+                  f"{done_jobs / elapsed:.1f} samples per second.")
+    finally:
+        writer.close()
+        validator.print_stats()
+
+    print(f"Done, wrote {writer.written} examples to {writer.path}.")
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import random
+import re
+
+try:
+    from vllm import LLM, SamplingParams
+except ImportError:
+    LLM = SamplingParams = None
+
+try:
+    import ollama
+except ImportError:
+    ollama = None
+
+
+# global parameters
+MAX_TOKENS = 1000
+TEMPERATURE = 0.6
+TOP_P = 0.8
+TOP_K = 100
+STOP = "<end>"
+OLLAMA_CONCURRENCY = 8
+OLLAMA_TIMEOUT = 300.0
+BACKENDS = ["vllm", "ollama", "fake"]
+ATTRIBUTE_PATTERN = re.compile(r'(\w+)="([^"]*)"')
+FAKE_TEMPLATES = [
+    "{name} {surname} opened the door and looked at the rain for a long time.",
+    "The letter was signed by {name} {surname}, who had left the city years ago.",
+    "Nobody expected {name} to come back, but the {surname} family welcomed them warmly.",
+    "\"We have to go now,\" {name} said, and Mr. {surname} nodded.",
+]
+
+
+class VllmBackend:
+    """Generates with vLLM. All the prompts of a call are submitted at once, so vLLM batches them continuously."""
+
+    def __init__(self, model, num_gpus=1, seed=17, quantization="GPTQ"):
+        if LLM is None:
+            raise ImportError("the vllm backend requires vllm, install it with 'pip install vllm'")
+
+        self.llm = LLM(model=model, gpu_memory_utilization=0.8, max_model_len=1500, tensor_parallel_size=num_gpus,
+                       seed=seed, quantization=quantization)
+
+    def generate(self, prompts, seeds):
+        sampling_params = [SamplingParams(top_k=TOP_K, max_tokens=MAX_TOKENS, top_p=TOP_P, temperature=TEMPERATURE,
+                                          stop=STOP, seed=seed) for seed in seeds]
+        outputs = self.llm.generate(prompts, sampling_params)
+        return [output.outputs[0].text.strip() for output in outputs]
+
+##----------------------------------------##
+
+class OllamaBackend:
+    """Generates with an Ollama server, with at most concurrency requests in flight."""
+
+    def __init__(self, model, host=None, concurrency=OLLAMA_CONCURRENCY, timeout=OLLAMA_TIMEOUT):
+        if ollama is None:
+            raise ImportError("the ollama backend requires ollama, install it with 'pip install ollama'")
+
+        self.model = model
+        self.host = host
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    async def generate_one(self, client, semaphore, prompt, seed):
+        options = {"num_predict": MAX_TOKENS, "temperature": TEMPERATURE, "top_p": TOP_P, "top_k": TOP_K,
+                   "stop": [STOP], "seed": seed}
+        try:
+            async with semaphore:
+                res = await asyncio.wait_for(client.generate(self.model, prompt=prompt, stream=False, options=options),
+                                             timeout=self.timeout)
+            return str(res["response"]).strip()
+        except Exception as ex:
+            print(f"Exception (while generating from prompt): {ex!r}!")
+            return None
+
+    async def generate_all(self, prompts, seeds):
+        client = ollama.AsyncClient(host=self.host)
+        semaphore = asyncio.Semaphore(max(1, self.concurrency))
+        return await asyncio.gather(*[self.generate_one(client, semaphore, prompt, seed) for prompt, seed in zip(prompts, seeds)])
+
+    def generate(self, prompts, seeds):
+        return asyncio.run(self.generate_all(prompts, seeds))
+
+##----------------------------------------##
+
+class FakeBackend:
+    """Answers every prompt at once with a deterministic JSON passage mentioning the name and the surname of its
+    <start> attributes. For testing the pipeline without a GPU or a server."""
+
+    def generate(self, prompts, seeds):
+        outputs = []
+        for prompt, seed in zip(prompts, seeds):
+            attributes = dict(ATTRIBUTE_PATTERN.findall(prompt.rsplit("<start", 1)[-1]))
+            name = attributes.get("name", "John")
+            surname = attributes.get("surname", "Smith")
+            text = random.Random(seed).choice(FAKE_TEMPLATES).format(name=name, surname=surname)
+            outputs.append(json.dumps({"text": text, "entities": [{"entity": name, "types": ["name"]},
+                                                                  {"entity": surname, "types": ["surname"]}]}))
+
+        return outputs
+
+##----------------------------------------##
+
+def make_backend(name, model, num_gpus=1, seed=17, host=None, concurrency=OLLAMA_CONCURRENCY):
+    """Creates the generation backend: vllm, ollama or fake. Every backend has generate(prompts, seeds), which returns
+    the outputs in the order of the prompts (None for a failed one)."""
+    if name == "vllm":
+        return VllmBackend(model, num_gpus, seed)
+    elif name == "ollama":
+        return OllamaBackend(model, host, concurrency)
+    elif name == "fake":
+        return FakeBackend()
+    raise ValueError(f"unknown generation backend {name}")
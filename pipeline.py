@@ -0,0 +1,65 @@
+import queue
+import threading
+from collections import deque
+
+
+# global parameters
+PUT_TIMEOUT = 0.1       # seconds between checks whether the consumer has stopped
+
+
+def prefetch(iterable, size):
+    """Runs the iterable in a background thread, keeping at most size items ahead of the consumer.
+    This lets the upstream stages (e.g. reading page N+1) overlap with the downstream ones (e.g. inference on page N)."""
+    items = queue.Queue(maxsize=max(1, size))
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(("item", item)):
+                    return
+        except BaseException as ex:
+            put(("error", ex))
+            return
+        put(("done", None))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            kind, item = items.get()
+            if kind == "done":
+                return
+            if kind == "error":
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+##----------------------------------------##
+
+def bounded_map(executor, fn, tasks, window):
+    """Like executor.map, but keeps at most window tasks submitted, so the results don't pile up in memory.
+    The results are yielded in the order of the tasks."""
+    futures = deque()
+    try:
+        for task in tasks:
+            futures.append(executor.submit(fn, *task))
+            if len(futures) >= window:
+                yield futures.popleft().result()
+
+        while futures:
+            yield futures.popleft().result()
+    finally:
+        for future in futures:
+            future.cancel()
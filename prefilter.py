@@ -0,0 +1,116 @@
+import re
+from ner.constants import FIRST_NAMES, SECOND_NAMES
+
+try:
+    import ahocorasick  # pyahocorasick, optional
+except ImportError:
+    ahocorasick = None
+
+
+# global parameters
+WORD_PATTERN = re.compile(r"[^\W\d_]+(?:['’-][^\W\d_]+)*")
+SENTENCE_END_PATTERN = re.compile(r'[.!?:;"“”]\s*$')
+# capitalized words that are not names, even in the middle of a sentence
+COMMON_CAPITALIZED = {
+    "i", "i'm", "i've", "i'll", "i'd", "mr", "mrs", "ms", "dr", "sir", "lady", "lord", "god",
+    "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday",
+    "january", "february", "march", "april", "may", "june", "july", "august",
+    "september", "october", "november", "december", "chapter", "english",
+}
+# common words that start sentences, a capitalized sentence-initial word that isn't one of them may be a name
+COMMON_SENTENCE_STARTERS = {
+    "a", "an", "the", "this", "that", "these", "those", "there", "here", "then", "now", "so", "but", "and", "or", "nor",
+    "yet", "for", "if", "when", "while", "as", "after", "before", "since", "until", "because", "though", "although",
+    "once", "still", "even", "just", "only", "also", "perhaps", "maybe", "yes", "no", "not", "oh", "ah", "well", "why",
+    "what", "who", "whom", "whose", "which", "where", "how", "whatever", "however", "meanwhile", "suddenly", "finally",
+    "instead", "later", "soon", "again", "already", "never", "always", "sometimes", "often", "indeed", "besides",
+    "he", "she", "it", "we", "you", "they", "his", "her", "its", "our", "your", "their", "my", "me", "him", "us", "them",
+    "he's", "she's", "it's", "we're", "you're", "they're", "that's", "there's", "don't", "didn't", "can't", "won't",
+    "in", "on", "at", "by", "with", "without", "from", "to", "of", "into", "onto", "over", "under", "about", "around",
+    "through", "during", "against", "between", "among", "behind", "beside", "beyond", "inside", "outside", "near",
+    "is", "was", "are", "were", "be", "been", "do", "does", "did", "have", "has", "had", "can", "could", "would",
+    "should", "must", "might", "shall", "let", "one", "two", "three", "some", "any", "all", "both", "each", "every",
+    "many", "much", "more", "most", "few", "other", "another", "such", "nothing", "something", "everything",
+    "nobody", "somebody", "everyone", "someone", "none", "neither", "either", "like", "look", "come", "go",
+    "good", "very", "too", "thank", "thanks", "please", "sorry", "dear", "first", "next", "last", "chapter",
+}
+# names that are also common English words, matching them would let almost every chunk through
+GAZETTEER_STOPWORDS = {"he", "sun", "ma", "mark", "max", "song", "white", "park", "will", "may", "long", "rose", "bill"}
+
+
+def load_names(file_paths):
+    """Reads the user supplied name lists, one name per line."""
+    names = []
+    for file_path in file_paths:
+        with open(file_path, "r", encoding="utf-8") as f:
+            names += [line.strip() for line in f if line.strip()]
+
+    return names
+
+##----------------------------------------##
+
+def has_capitalized_word(text):
+    """Looks for a capitalized word that may be a name: in the middle of a sentence, or at its start if it isn't
+    a common sentence starter (so "Elizabeth sighed." passes, "The door opened." doesn't). Must run on the text
+    before lowercasing."""
+    previous_end = None
+    for match in WORD_PATTERN.finditer(text):
+        word = match.group(0)
+        starts_sentence = previous_end is None or SENTENCE_END_PATTERN.search(text[previous_end:match.start()]) is not None
+        previous_end = match.end()
+
+        if not word[0].isupper():
+            continue
+        if word.lower() in COMMON_CAPITALIZED or (starts_sentence and word.lower() in COMMON_SENTENCE_STARTERS):
+            continue
+        return True
+    return False
+
+##----------------------------------------##
+
+class NamePrefilter:
+    """Cheap check whether a chunk may contain a human name, used to skip the model for the chunks that clearly don't.
+    A chunk passes if it contains a known name (a gazetteer match) or a capitalized word that may be a name
+    (see has_capitalized_word)."""
+
+    def __init__(self, names=()):
+        self.names = {name.lower() for name in list(FIRST_NAMES) + list(SECOND_NAMES) + list(names) if name.strip()}
+        self.names -= GAZETTEER_STOPWORDS
+        self.checked = 0
+        self.skipped = 0
+
+        if ahocorasick is not None:
+            self.automaton = ahocorasick.Automaton()
+            for name in self.names:
+                self.automaton.add_word(name, len(name))
+            self.automaton.make_automaton()
+            self.pattern = None
+        else:
+            self.automaton = None
+            names = sorted(self.names, key=len, reverse=True)
+            self.pattern = re.compile(r"(?<!\w)(?:" + "|".join(re.escape(name) for name in names) + r")(?!\w)")
+
+    def has_known_name(self, text):
+        text = text.lower()
+        if self.automaton is None:
+            return self.pattern.search(text) is not None
+
+        for end, length in self.automaton.iter(text):
+            start = end - length + 1
+            # only whole words are matches
+            if (start == 0 or not text[start - 1].isalnum()) and (end + 1 == len(text) or not text[end + 1].isalnum()):
+                return True
+        return False
+
+    def check(self, text, original_text=None):
+        """Returns False if the chunk clearly has no name candidates. original_text is the chunk before lowercasing."""
+        self.checked += 1
+        if self.has_known_name(text) or has_capitalized_word(original_text or text):
+            return True
+
+        self.skipped += 1
+        return False
+
+    def print_stats(self):
+        print(f"Prefilter skipped {self.skipped} of {self.checked} chunks "
+              f"({(100.0 * self.skipped / self.checked if self.checked else 0.0):.1f}%).")
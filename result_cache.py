@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+
+# global parameters
+CACHE_PATH = ".cache/results.sqlite"
+CACHE_MAX_MB = 512
+EVICTION_CHECK_INTERVAL = 1000  # puts between two size checks
+EVICTION_TARGET = 0.9           # evict down to this fraction of the maximal size
+LOCK_TIMEOUT = 1.0              # seconds to wait for a cache locked by another process
+
+
+def normalize_text(text):
+    """Collapses the white spaces, so formatting differences don't break the cache."""
+    return " ".join(text.split())
+
+##----------------------------------------##
+
+def make_key(text, method, model, options, prompt="", exact=False):
+    """Hashes everything that affects the extraction result of a chunk. The white spaces of the text are collapsed,
+    unless exact is set for results with offsets into the raw text (such as the NER entities)."""
+    key_data = json.dumps({
+        "text": text if exact else normalize_text(text),
+        "method": method,
+        "model": model,
+        "options": options,
+        "prompt": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+##----------------------------------------##
+
+class ResultCache:
+    """On-disk cache of extraction results, keyed by the content hash of the chunk and the run configuration.
+    Several processes can share it: it is in WAL mode, the callers commit after every batch, and a cache locked by
+    another process counts as a miss (a result that can't be written is just not cached)."""
+
+    def __init__(self, path=CACHE_PATH, max_mb=CACHE_MAX_MB):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.puts_since_check = 0
+        # the server reads and writes from its batch thread, one thread at a time
+        self.db = sqlite3.connect(path, timeout=LOCK_TIMEOUT, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+
+    def get(self, key):
+        """Returns the cached result, or None on a miss."""
+        try:
+            row = self.db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        except sqlite3.OperationalError as ex:
+            print(f"Exception (while reading the cache): {ex}!")
+            row = None
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        value = json.dumps(value, ensure_ascii=False)
+        try:
+            self.db.execute("INSERT OR REPLACE INTO results (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                            (key, value, len(value), time.time()))
+
+            self.puts_since_check += 1
+            if self.puts_since_check >= EVICTION_CHECK_INTERVAL:
+                self.evict()
+        except sqlite3.OperationalError as ex:
+            print(f"Exception (while writing the cache): {ex}!")
+
+    def commit(self):
+        """Commits the reads and writes of a batch, so the cache isn't locked for the other processes in between."""
+        try:
+            self.db.commit()
+        except sqlite3.OperationalError as ex:
+            print(f"Exception (while committing the cache): {ex}!")
+
+    def evict(self):
+        """Drops the least recently used results until the cache fits in its maximal size."""
+        self.puts_since_check = 0
+        total_size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+
+        target_size = self.max_bytes * EVICTION_TARGET
+        evicted = 0
+        for key, size in self.db.execute("SELECT key, size FROM results ORDER BY last_used").fetchall():
+            if total_size <= target_size:
+                break
+            self.db.execute("DELETE FROM results WHERE key = ?", (key,))
+            total_size -= size
+            evicted += 1
+
+        print(f"Evicted {evicted} results from the cache.")
+
+    def close(self):
+        try:
+            self.evict()
+            self.db.commit()
+        except sqlite3.OperationalError as ex:
+            print(f"Exception (while closing the cache): {ex}!")
+        self.db.close()
+
+    def print_stats(self):
+        lookups = self.hits + self.misses
+        print(f"Result cache: {self.hits} hits, {self.misses} misses "
+              f"({(100.0 * self.hits / lookups if lookups else 0.0):.1f}% hit rate).")
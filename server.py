@@ -0,0 +1,189 @@
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from metrics import Metrics
+
+
+# global parameters
+HOST = "127.0.0.1"
+PORT = 8080
+MAX_BATCH_SIZE = 32
+MAX_WAIT = 0.01         # seconds a batch waits for more chunks after its first one
+REQUEST_QUEUE_SIZE = 128    # pending connections, the default of 5 drops bursts of concurrent clients
+
+
+class MicroBatcher:
+    """Groups the chunks of concurrent requests into batches of at most max_batch_size chunks. A batch is processed
+    once it is full, or max_wait seconds after its first chunk arrived. The batches run one at a time on a single
+    thread, which owns the (warm) models."""
+
+    def __init__(self, process, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_WAIT):
+        self.process = process
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.stats = Metrics(enabled=True)
+        self.stats_lock = threading.Lock()     # the handler threads and the batch thread record concurrently
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, texts, original_texts=None):
+        """Queues the chunks and waits for their results. Raises RuntimeError if their batch failed."""
+        start_time = time.perf_counter()
+        items = [{"text": text, "original_text": original_text, "queued": start_time, "done": threading.Event(),
+                  "result": None, "error": None}
+                 for text, original_text in zip(texts, original_texts or texts)]
+        for item in items:
+            self.requests.put(item)
+        for item in items:
+            item["done"].wait()
+
+        with self.stats_lock:
+            self.stats.record("request", time.perf_counter() - start_time)
+        errors = [item["error"] for item in items if item["error"] is not None]
+        if errors:
+            raise RuntimeError(errors[0])
+        return [item["result"] for item in items]
+
+    def next_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            start_time = time.perf_counter()
+            with self.stats_lock:
+                self.stats.count("batches")
+                self.stats.count("batched_chunks", len(batch))
+                for item in batch:
+                    self.stats.record("queue_wait", start_time - item["queued"])
+
+            try:
+                results = self.process([item["text"] for item in batch], [item["original_text"] for item in batch])
+                with self.stats_lock:
+                    self.stats.record("batch", time.perf_counter() - start_time)
+                if results is None:
+                    raise RuntimeError("the extraction failed")
+            except Exception as ex:
+                print(f"Exception (while processing a batch): {ex!r}!")
+                results = [None] * len(batch)
+                for item in batch:
+                    item["error"] = str(ex)
+
+            for item, result in zip(batch, results):
+                item["result"] = result
+                item["done"].set()
+
+    def summary(self):
+        with self.stats_lock:
+            summary = self.stats.summary()
+        batches = summary["counters"].get("batches", 0)
+        return {
+            "queue_depth": self.requests.qsize(),
+            "requests": summary["stages"].get("request", {}),
+            "queue_wait": summary["stages"].get("queue_wait", {}),
+            "batches": summary["stages"].get("batch", {}),
+            "mean_batch_size": summary["counters"].get("batched_chunks", 0) / batches if batches else 0.0,
+            "peak_rss_mb": summary["peak_rss_mb"],
+        }
+
+##----------------------------------------##
+
+class ExtractionHandler(BaseHTTPRequestHandler):
+    """JSON API of the extraction service:
+    POST /extract {"chunks": ["text", ...]} - the entities of every chunk,
+    POST /extract_pdf {"path": "book.pdf", "pages": "2-10"} - a record of every chunk of the pages,
+    GET /metrics - the queue depth, the request, queue wait and batch latencies and the mean batch size,
+    GET /health."""
+    batcher = None
+    read_document = None
+
+    def send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        elif self.path == "/metrics":
+            self.send_json(200, self.batcher.summary())
+        else:
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except ValueError as ex:
+            self.send_json(400, {"error": f"invalid JSON: {ex}"})
+            return
+        if not isinstance(request, dict):
+            self.send_json(400, {"error": "the request must be a JSON object"})
+            return
+
+        try:
+            if self.path == "/extract":
+                chunks = request.get("chunks")
+                if not isinstance(chunks, list) or not all(isinstance(chunk, str) for chunk in chunks):
+                    self.send_json(400, {"error": "'chunks' must be a list of strings"})
+                    return
+                self.send_json(200, {"results": self.batcher.submit(chunks)})
+            elif self.path == "/extract_pdf":
+                if not isinstance(request.get("path"), str):
+                    self.send_json(400, {"error": "'path' must be a string"})
+                    return
+                if request.get("pages") is not None and not isinstance(request["pages"], str):
+                    self.send_json(400, {"error": "'pages' must be a string such as \"2-10\""})
+                    return
+                chunks, make_records = self.read_document(request["path"], request.get("pages"))
+                results = self.batcher.submit([chunk["text"] for chunk in chunks], [chunk["original_text"] for chunk in chunks])
+                self.send_json(200, {"records": make_records(chunks, results)})
+            else:
+                self.send_json(404, {"error": f"unknown path {self.path}"})
+        except (OSError, ValueError) as ex:
+            self.send_json(400, {"error": str(ex)})
+        except RuntimeError as ex:
+            self.send_json(500, {"error": str(ex)})
+
+    def log_message(self, format, *args):
+        pass
+
+##----------------------------------------##
+
+class ExtractionServer(ThreadingHTTPServer):
+    request_queue_size = REQUEST_QUEUE_SIZE
+    daemon_threads = True
+
+##----------------------------------------##
+
+def serve(process, read_document, host=HOST, port=PORT, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_WAIT):
+    """Serves the extraction API until interrupted. process(texts, original_texts) returns the results of a batch,
+    read_document(path, pages) returns the chunks of a document and a function making their records."""
+    batcher = MicroBatcher(process, max_batch_size, max_wait)
+    handler = type("Handler", (ExtractionHandler,), {"batcher": batcher, "read_document": staticmethod(read_document)})
+    server = ExtractionServer((host, port), handler)
+    print(f"Serving on http://{host}:{server.server_address[1]}, batches of up to {max_batch_size} chunks, "
+          f"waiting up to {max_wait * 1000:.0f} ms.")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping the server.")
+    finally:
+        server.server_close()
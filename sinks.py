@@ -0,0 +1,99 @@
+import json
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+# global parameters
+JSONL_BUFFER_SIZE = 1024 * 1024     # bytes
+PARQUET_BATCH_SIZE = 10000          # records per row group
+
+
+def make_record(chunk, entities, model, latency, error=None):
+    """Builds the output record of a chunk. The entity offsets are relative to the chunk text,
+    the chunk offsets (start, end) are relative to the page text. error is set when the chunk couldn't be parsed."""
+    return {
+        "document": os.path.basename(chunk["file"]),
+        "page": chunk["page"],
+        "chunk": chunk["index"],
+        "start": chunk.get("start"),
+        "end": chunk.get("end"),
+        "text": chunk["text"],
+        "entities": [{"text": ent["text"], "label": ent["label"], "score": ent.get("score"),
+                      "start": ent.get("start"), "end": ent.get("end")} for ent in entities],
+        "model": model,
+        "latency": latency,
+        "error": error,
+    }
+
+##----------------------------------------##
+
+class JsonlSink:
+    """Writes one compact JSON record per line, through a large write buffer.
+    When resuming from an offset, the records after it are dropped and the new ones are appended."""
+
+    def __init__(self, path, offset=None):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.path = path
+        if offset is not None and os.path.exists(path):
+            os.truncate(path, offset)
+            self.file = open(path, "a", encoding="utf-8", buffering=JSONL_BUFFER_SIZE)
+        else:
+            self.file = open(path, "w", encoding="utf-8", buffering=JSONL_BUFFER_SIZE)
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        self.file.write("\n")
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+##----------------------------------------##
+
+class ParquetSink:
+    """Writes the records into a Parquet file, one row group per PARQUET_BATCH_SIZE records. Requires pyarrow."""
+
+    def __init__(self, path):
+        if pa is None:
+            raise ImportError("the Parquet output requires pyarrow, install it with 'pip install pyarrow'")
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        entity_type = pa.struct([("text", pa.string()), ("label", pa.string()), ("score", pa.float64()),
+                                 ("start", pa.int64()), ("end", pa.int64())])
+        self.schema = pa.schema([("document", pa.string()), ("page", pa.int64()), ("chunk", pa.int64()),
+                                 ("start", pa.int64()), ("end", pa.int64()), ("text", pa.string()),
+                                 ("entities", pa.list_(entity_type)), ("model", pa.string()), ("latency", pa.float64()),
+                                 ("error", pa.string())])
+        self.path = path
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+        if len(self.records) >= PARQUET_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.records:
+            self.writer.write_table(pa.Table.from_pylist(self.records, schema=self.schema))
+            self.records = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()